@@ -1,46 +1,47 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, g, has_request_context
 from flask_cors import CORS
-from flask import render_template_string
-from xhtml2pdf import pisa
 from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.http import is_resource_modified
 import firebase_admin
 from firebase_admin import credentials, auth
 
 import mysql.connector
+from mysql.connector import errorcode
 import os
-from xhtml2pdf import pisa
+import hashlib
+import tempfile
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import (
+    FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeout, wait
+)
+from concurrent.futures.process import BrokenProcessPool
+from decimal import Decimal
+from io import BytesIO, StringIO
+import multiprocessing
+import queue
+import signal
+import socket
+import threading
+import time
+import subprocess
+import zipfile
+import sys
 from datetime import datetime, timedelta
-# PDF + QR
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.utils import ImageReader
-import qrcode
-import ssl
 from dotenv import load_dotenv
-import os
 
 load_dotenv()
 
-# Platypus (Modern PDF Design)
-from reportlab.platypus import (
-    SimpleDocTemplate,
-    Paragraph,
-    Spacer,
-    Table,
-    TableStyle,
-    Image
-)
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib import colors
-from reportlab.lib.units import inch
-
-from datetime import datetime
-import smtplib
-from email.message import EmailMessage
-
-import sib_api_v3_sdk
-from sib_api_v3_sdk.rest import ApiException
+# reportlab, qrcode and sib_api_v3_sdk are imported where they are used:
+# together they are ~350 ms of import time a worker that only serves JSON
+# never needs. Under gunicorn preload_app they load once in the master via
+# warm_up() and are shared with the workers (see gunicorn.conf.py).
 import base64
+import copy
+import csv
+import functools
+import itertools
+import click
 
 # ---------------- APP SETUP ----------------
 app  = Flask(__name__)
@@ -66,9 +67,9 @@ CORS(
         r"/health": {"origins": origins_list}
     },
     supports_credentials=True,
-    allow_headers=["Authorization", "Content-Type"],
+    allow_headers=["Authorization", "Content-Type", "Idempotency-Key"],
     methods=["GET", "POST", "OPTIONS"],
-    expose_headers=["Content-Disposition"]
+    expose_headers=["Content-Disposition", "Idempotent-Replayed"]
 )
 
 # ---------------- FIREBASE INIT ----------------
@@ -82,21 +83,42 @@ if not firebase_admin._apps:
 
     cred_dict = json.loads(firebase_json)
     cred = credentials.Certificate(cred_dict)
-    firebase_admin.initialize_app(cred)
+    # The SDK's own default HTTP timeout is 120 s
+    firebase_admin.initialize_app(cred, {
+        "httpTimeout": float(os.getenv("FIREBASE_HTTP_TIMEOUT", "10"))
+    })
   # ---------------- BREVO CONFIG ----------------
 BREVO_API_KEY = os.getenv("BREVO_API_KEY")
-brevo_api = None
+# Point at a local fake Brevo server for testing, e.g. http://127.0.0.1:9000/v3
+BREVO_API_HOST = os.getenv("BREVO_API_HOST")
+_brevo = {"api": None, "pid": None}
+_brevo_lock = threading.Lock()
 
-if BREVO_API_KEY:
-    brevo_config = sib_api_v3_sdk.Configuration()
-    brevo_config.api_key["api-key"] = BREVO_API_KEY
-    brevo_api = sib_api_v3_sdk.TransactionalEmailsApi(
-        sib_api_v3_sdk.ApiClient(brevo_config)
-    )
-else:
+if not BREVO_API_KEY:
     print("⚠ BREVO_API_KEY not set. Emails disabled.")
 
 
+def get_brevo_api():
+    """Brevo client, created on first send (one per process)."""
+    if _brevo["pid"] == os.getpid():
+        return _brevo["api"]
+
+    with _brevo_lock:
+        if _brevo["pid"] != os.getpid():
+            import sib_api_v3_sdk
+            brevo_config = sib_api_v3_sdk.Configuration()
+            brevo_config.api_key["api-key"] = BREVO_API_KEY
+            if BREVO_API_HOST:
+                brevo_config.host = BREVO_API_HOST
+            # One client per process; urllib3 keeps its HTTPS connections alive
+            brevo_config.connection_pool_maxsize = 4
+            _brevo["api"] = sib_api_v3_sdk.TransactionalEmailsApi(
+                sib_api_v3_sdk.ApiClient(brevo_config)
+            )
+            _brevo["pid"] = os.getpid()
+    return _brevo["api"]
+
+
 # ---------------- MYSQL CONFIG ----------------
 db_config = {
     "host": os.getenv("MYSQLHOST"),
@@ -111,11 +133,574 @@ db_config = {
 
 
 
+# ---------------- METRICS ----------------
+# Request latency per route, status counts, and time spent in each phase
+# (db checkout, SQL, token verify, QR/PDF render, Brevo). Each gunicorn
+# worker writes a snapshot to METRICS_DIR; /metrics adds them all up.
+METRICS_DIR = os.getenv("METRICS_DIR", os.path.join(tempfile.gettempdir(), "parksmart-metrics"))
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "5"))
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "1000"))
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}  # (name, labels) -> [bucket counts..., sum, count]
+        self.counters = {}    # (name, labels) -> value
+        self._flushed_at = 0.0
+
+    def observe(self, name, labels, seconds):
+        key = (name, labels)
+        with self._lock:
+            h = self.histograms.get(key)
+            if h is None:
+                h = self.histograms[key] = [0] * len(LATENCY_BUCKETS) + [0.0, 0]
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    h[i] += 1
+            h[-2] += seconds
+            h[-1] += 1
+
+    def inc(self, name, labels, amount=1):
+        key = (name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "histograms": [[n, list(l), list(v)] for (n, l), v in self.histograms.items()],
+                "counters": [[n, list(l), v] for (n, l), v in self.counters.items()],
+            }
+
+    def flush(self, force=False):
+        """Write this worker's snapshot (at most every METRICS_FLUSH_SECONDS)."""
+        if not force and time.time() - self._flushed_at < METRICS_FLUSH_SECONDS:
+            return
+        self._flushed_at = time.time()
+
+        try:
+            os.makedirs(METRICS_DIR, exist_ok=True)
+            data = self.snapshot()
+            data["gauges"] = flatten_stats(collect_stats())
+            path = os.path.join(METRICS_DIR, f"{os.getpid()}.json")
+            with open(path + ".tmp", "w") as f:
+                json.dump(data, f)
+            os.replace(path + ".tmp", path)
+        except Exception as e:
+            print("Metrics flush error:", e)
+
+
+metrics = Metrics()
+
+
+@contextmanager
+def timed(phase, sql=None):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.observe("parksmart_phase_duration_seconds", (phase,), elapsed)
+
+        if has_request_context() and "phases" in g:
+            g.phases[phase] = g.phases.get(phase, 0.0) + elapsed
+            if sql is not None and len(g.queries) < 50:
+                g.queries.append({
+                    "sql": " ".join(sql.split())[:300],
+                    "ms": round(elapsed * 1000, 2)
+                })
+
+
+class TimedCursor:
+    """Cursor wrapper that times every execute()."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._cursor.close()
+
+    def execute(self, operation, params=None):
+        with timed("sql", operation):
+            return self._cursor.execute(operation, params)
+
+    def executemany(self, operation, seq_params):
+        with timed("sql", operation):
+            return self._cursor.executemany(operation, seq_params)
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    g.phases = {}
+    g.queries = []
+
+
+@app.after_request
+def record_request_metrics(response):
+    if "request_start" not in g:
+        return response
+
+    elapsed = time.perf_counter() - g.request_start
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+
+    metrics.observe("parksmart_http_request_duration_seconds", (request.method, route), elapsed)
+    metrics.inc("parksmart_http_requests_total", (request.method, route, str(response.status_code)))
+
+    if elapsed * 1000 >= SLOW_REQUEST_MS:
+        print("🐢 Slow request:", json.dumps({
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            "ms": round(elapsed * 1000, 1),
+            "phases_ms": {k: round(v * 1000, 1) for k, v in g.phases.items()},
+            "queries": g.queries,
+        }))
+
+    metrics.flush()
+    return response
+
+
+# ---------------- MYSQL CONNECTION POOL ----------------
+# ✅ Set in Koyeb (optional):
+# DB_POOL_SIZE=5            max connections per gunicorn worker
+# DB_POOL_TIMEOUT=10        seconds to wait for a free connection
+# DB_POOL_PING_AFTER=30     ping idle connections older than this before reuse
+db_pool_config = {
+    "size": int(os.getenv("DB_POOL_SIZE", "5")),
+    "timeout": float(os.getenv("DB_POOL_TIMEOUT", "10")),
+    "ping_after": float(os.getenv("DB_POOL_PING_AFTER", "30")),
+}
+
+
+class PoolExhausted(Exception):
+    pass
+
+
+class PooledConnection:
+    """Checked-out connection. close() hands it back to the pool."""
+
+    def __init__(self, pool, cnx):
+        self._pool = pool
+        self._cnx = cnx
+
+    def __getattr__(self, name):
+        return getattr(self._cnx, name)
+
+    def cursor(self, *args, **kwargs):
+        return TimedCursor(self._cnx.cursor(*args, **kwargs))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        if self._cnx is not None:
+            cnx, self._cnx = self._cnx, None
+            self._pool.release(cnx)
+
+
+class DBPool:
+    """Small LIFO pool of mysql connections, one per gunicorn worker.
+
+    Connections are opened lazily up to `size`. Idle connections older than
+    `ping_after` seconds are pinged (and reconnected) before being handed out.
+    """
+
+    def __init__(self, size, timeout, ping_after):
+        self.size = size
+        self.timeout = timeout
+        self.ping_after = ping_after
+        self.pid = os.getpid()
+
+        self._idle = []  # (cnx, released_at), most recently released last
+        # Guards the pool state; waiters are notified when a connection is
+        # released or discarded (which leaves room to open a new one)
+        self._lock = threading.Condition()
+        self._created = 0
+        self._in_use = 0
+
+        self._checkouts = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._reconnects = 0
+        self._checkout_seconds = 0.0
+        self._checkout_max = 0.0
+
+    def _connect(self):
+        try:
+            return mysql.connector.connect(**db_config)
+        except Exception:
+            self._discarded()
+            raise
+
+    def _discarded(self):
+        with self._lock:
+            self._created -= 1
+            self._lock.notify()
+
+    def _checkout(self):
+        deadline = time.monotonic() + self.timeout
+        waited = False
+
+        with self._lock:
+            while not self._idle and self._created >= self.size:
+                if not waited:
+                    self._waits += 1
+                    waited = True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolExhausted(
+                        f"No free DB connection after {self.timeout}s (pool size {self.size})"
+                    )
+                self._lock.wait(remaining)
+
+            if not self._idle:
+                self._created += 1
+                cnx = None
+            else:
+                cnx, released_at = self._idle.pop()
+
+        if cnx is None:
+            return self._connect()
+
+        if time.monotonic() - released_at > self.ping_after:
+            try:
+                cnx.ping()
+            except mysql.connector.Error:
+                # Stale connection (server closed it / wait_timeout), reopen it
+                with self._lock:
+                    self._reconnects += 1
+                try:
+                    cnx.reconnect(attempts=2, delay=0)
+                except mysql.connector.Error:
+                    self._discarded()
+                    raise
+
+        return cnx
+
+    def acquire(self):
+        start = time.perf_counter()
+        with timed("db_connect"):
+            cnx = self._checkout()
+        elapsed = time.perf_counter() - start
+
+        with self._lock:
+            self._in_use += 1
+            self._checkouts += 1
+            self._checkout_seconds += elapsed
+            self._checkout_max = max(self._checkout_max, elapsed)
+
+        return PooledConnection(self, cnx)
+
+    def release(self, cnx):
+        with self._lock:
+            self._in_use -= 1
+
+        # Connection was inherited from the parent process, never reuse it
+        if os.getpid() != self.pid:
+            return
+
+        try:
+            if cnx.unread_result:
+                cnx.consume_results()
+            if cnx.in_transaction:
+                cnx.rollback()
+        except Exception:
+            try:
+                cnx.close()
+            except Exception:
+                pass
+            self._discarded()
+            return
+
+        with self._lock:
+            self._idle.append((cnx, time.monotonic()))
+            self._lock.notify()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pid": self.pid,
+                "size": self.size,
+                "open": self._created,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "checkouts": self._checkouts,
+                "waits": self._waits,
+                "timeouts": self._timeouts,
+                "reconnects": self._reconnects,
+                "checkout_avg_ms": round(
+                    self._checkout_seconds / self._checkouts * 1000, 3
+                ) if self._checkouts else 0.0,
+                "checkout_max_ms": round(self._checkout_max * 1000, 3),
+            }
+
+
+_db_pool = None
+_db_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _db_pool
+
+    # Gunicorn forks workers after import: every process builds its own pool
+    # instead of sharing the parent's sockets.
+    if _db_pool is None or _db_pool.pid != os.getpid():
+        with _db_pool_lock:
+            if _db_pool is None or _db_pool.pid != os.getpid():
+                _db_pool = DBPool(**db_pool_config)
+
+    return _db_pool
+
+
 def get_db():
-    return mysql.connector.connect(**db_config)
+    """Check out a pooled connection. Use as `with get_db() as db:`."""
+    return get_pool().acquire()
+
+
+# ---------------- IN-PROCESS CACHES ----------------
+class LRUCache:
+    """Thread-safe LRU with optional per-entry TTL and hit/miss counters."""
+
+    def __init__(self, max_size, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                value, expires_at = item
+                if expires_at is None or expires_at > time.time():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl is not None else None
+
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def get_or_create(self, key, create):
+        """Return the cached value, or build it once even if many threads ask."""
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        with self._lock:
+            key_lock = self._inflight.setdefault(key, threading.Lock())
+
+        with key_lock:
+            # Another thread may have built it while we waited
+            with self._lock:
+                item = self._data.get(key)
+            if item is not None:
+                value = item[0]
+            else:
+                value = create()
+                self.set(key, value)
+
+        with self._lock:
+            self._inflight.pop(key, None)
+
+        return value
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+# ---------------- OUTBOUND CALLS ----------------
+# Firebase calls made for a request (token verify, cert fetch, get_user)
+# run on a small per-process pool: at most OUTBOUND_MAX_CONCURRENCY at
+# once, at most OUTBOUND_MAX_PENDING queued, and the caller gives up after
+# OUTBOUND_TIMEOUT seconds. A slow Google then costs a request thread a
+# few seconds and a 503, not every thread for as long as Google takes.
+# (Brevo sends already run on the mailer thread, see OUTBOUND MAIL.)
+OUTBOUND_MAX_CONCURRENCY = int(os.getenv("OUTBOUND_MAX_CONCURRENCY", "8"))
+OUTBOUND_MAX_PENDING = int(os.getenv("OUTBOUND_MAX_PENDING", "32"))
+OUTBOUND_TIMEOUT = float(os.getenv("OUTBOUND_TIMEOUT", "5"))
+
+
+class OutboundUnavailable(Exception):
+    """The external service is too slow or too busy right now."""
+
+
+class OutboundPool:
+    def __init__(self, name, max_workers, max_pending):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.calls = 0
+        self.timeouts = 0
+        self.rejected = 0
+
+    def _get_executor(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_workers, thread_name_prefix=self.name
+                    )
+                    self.pending = 0
+                    self._pid = os.getpid()
+        return self._executor
+
+    def call(self, fn, *args, timeout=None, **kwargs):
+        executor = self._get_executor()
+        timeout = timeout or OUTBOUND_TIMEOUT
+
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise OutboundUnavailable(f"{self.name}: too many calls in flight")
+            self.pending += 1
+            self.calls += 1
+
+        future = executor.submit(fn, *args, **kwargs)
+        future.add_done_callback(self._done)
+
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeout:
+            future.cancel()  # still queued: never runs
+            with self._lock:
+                self.timeouts += 1
+            raise OutboundUnavailable(f"{self.name}: no answer within {timeout:g}s")
+
+    def _done(self, future):
+        with self._lock:
+            self.pending -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_concurrency": self.max_workers,
+                "pending": self.pending,
+                "calls": self.calls,
+                "timeouts": self.timeouts,
+                "rejected": self.rejected,
+            }
+
+
+firebase_calls = OutboundPool("firebase", OUTBOUND_MAX_CONCURRENCY, OUTBOUND_MAX_PENDING)
 
 
 # ---------------- TOKEN VERIFY ----------------
+# Decoded claims are cached per token (SHA-256 of the token) until the
+# token's `exp`, so dashboards polling with the same token skip the RSA
+# verification. The cache is dropped when Google rotates its signing keys.
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "2048"))
+TOKEN_KEYS_CHECK_SECONDS = int(os.getenv("TOKEN_KEYS_CHECK_SECONDS", "300"))
+FIREBASE_CERTS_URL = (
+    "https://www.googleapis.com/robot/v1/metadata/x509/"
+    "securetoken@system.gserviceaccount.com"
+)
+
+token_cache = LRUCache(TOKEN_CACHE_SIZE)
+_token_keys = {"ids": None, "checked_at": 0.0}
+_token_keys_lock = threading.Lock()
+
+
+def fetch_token_key_ids():
+    """Key IDs of the certs Firebase ID tokens are currently signed with."""
+    try:
+        # firebase_admin's own cache-controlled session: fetching through it
+        # also warms the certs verify_id_token() is going to use.
+        cert_request = auth._get_client(None)._token_verifier.request
+        response = firebase_calls.call(cert_request, FIREBASE_CERTS_URL)
+        return set(json.loads(response.data))
+    except AttributeError:
+        import requests
+        response = firebase_calls.call(requests.get, FIREBASE_CERTS_URL, timeout=OUTBOUND_TIMEOUT)
+        return set(response.json())
+
+
+def check_token_keys():
+    """Start a key check in the background when one is due; requests never
+    wait for it and keep serving from the cache meanwhile."""
+    if time.time() - _token_keys["checked_at"] < TOKEN_KEYS_CHECK_SECONDS:
+        return
+
+    # One check at a time; refresh_token_keys() releases the lock
+    if not _token_keys_lock.acquire(blocking=False):
+        return
+
+    try:
+        run_in_background(refresh_token_keys)
+    except Exception:
+        _token_keys_lock.release()
+        raise
+
+
+def refresh_token_keys():
+    """Caller holds _token_keys_lock."""
+    try:
+        key_ids = fetch_token_key_ids()
+        if _token_keys["ids"] is not None and key_ids != _token_keys["ids"]:
+            token_cache.clear()
+            print("🔑 Firebase signing keys rotated, token cache cleared")
+        _token_keys["ids"] = key_ids
+    except Exception as e:
+        print("Firebase cert fetch error:", e)
+    finally:
+        _token_keys["checked_at"] = time.time()
+        _token_keys_lock.release()
+
+
+def prefetch_token_certs():
+    """Fetch signing certs up front so the first request doesn't pay for it."""
+    _token_keys_lock.acquire()
+    refresh_token_keys()
+
+
 def verify_token():
     auth_header = request.headers.get("Authorization")
 
@@ -127,470 +712,1843 @@ def verify_token():
 
     token = auth_header.split("Bearer ")[1]
 
+    token_key = hashlib.sha256(token.encode()).hexdigest()
+    check_token_keys()
+
+    decoded = token_cache.get(token_key)
+    if decoded is not None:
+        return decoded, None
+
     try:
-        decoded = auth.verify_id_token(token, clock_skew_seconds=10)
+        with timed("verify_token"):
+            decoded = firebase_calls.call(auth.verify_id_token, token, clock_skew_seconds=10)
+
+        ttl = decoded.get("exp", 0) - time.time()
+        if ttl > 0:
+            token_cache.set(token_key, decoded, ttl=ttl)
+
         return decoded, None
+    except OutboundUnavailable as e:
+        print("Firebase Token Error:", e)
+        return None, ("Authentication service unavailable, please retry", 503)
     except Exception as e:
         print("Firebase Token Error:", e)
         return None, ("Invalid Firebase token", 401)
 
 
-# ---------------- GET USER EMAIL ----------------
-def get_user_email(firebase_uid):
-    user = auth.get_user(firebase_uid)
-    return user.email
+def verify_admin():
+    """verify_token() plus the `admin` custom claim granted by set_admin.py."""
+    decoded, error = verify_token()
+    if error:
+        return None, error
 
+    if not decoded.get("admin"):
+        return None, ("Admin access required", 403)
 
-# ================= ADD THIS FUNCTION HERE =================
+    return decoded, None
 
-def generate_ticket_pdf_and_send_email(ticket_id):
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM bookings WHERE id=%s", (ticket_id,))
-    booking = cursor.fetchone()
-    cursor.close()
-    db.close()
 
-    if not booking:
-        return
+# ---------------- GET USER EMAIL ----------------
+# Reads go through: in-process LRU -> `users` table -> Firebase (last resort).
+# A user found anywhere is guaranteed to have a `users` row afterwards.
+# Emails not confirmed with Firebase for USER_EMAIL_REFRESH_SECONDS are
+# served as-is and refreshed in the background.
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "4096"))
+USER_EMAIL_REFRESH_SECONDS = int(os.getenv("USER_EMAIL_REFRESH_SECONDS", "21600"))
 
-    map_link = f"https://www.google.com/maps?q={booking['latitude']},{booking['longitude']}"
+user_cache = LRUCache(USER_CACHE_SIZE)  # uid -> (email, confirmed_at)
+_user_refreshing = set()
+_user_refreshing_lock = threading.Lock()
 
-    tickets_dir = os.path.join(BASE_DIR, "tickets")
-    qr_dir = os.path.join(BASE_DIR, "qr_codes")
-    os.makedirs(tickets_dir, exist_ok=True)
-    os.makedirs(qr_dir, exist_ok=True)
+_background_executor = None
+_background_pid = None
 
-    pdf_path = os.path.join(tickets_dir, f"ticket_{ticket_id}.pdf")
-    qr_path = os.path.join(qr_dir, f"qr_{ticket_id}.png")
 
-    qrcode.make(map_link).save(qr_path)
+def run_in_background(fn, *args):
+    """Fire-and-forget on a small per-process thread pool."""
+    global _background_executor, _background_pid
 
-    c = canvas.Canvas(pdf_path, pagesize=A4)
-    w, h = A4
+    if _background_pid != os.getpid():
+        _background_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="bg")
+        _background_pid = os.getpid()
 
-    c.setFont("Helvetica-Bold", 20)
-    c.drawString(200, h - 80, "Parking Ticket")
+    return _background_executor.submit(fn, *args)
 
-    c.setFont("Helvetica", 12)
-    c.drawString(80, h - 140, f"Ticket ID: {booking['id']}")
-    c.drawString(80, h - 170, f"Slot No: {booking['slot_no']}")
-    c.drawString(80, h - 200, f"Vehicle No: {booking['vehicle_no']}")
-    c.drawString(80, h - 230, f"Location: {booking['location']}")
-    c.drawString(80, h - 260, f"Date: {booking['booking_date']}")
-    c.drawString(80, h - 290, f"Map: {map_link}")
-
-    c.drawImage(ImageReader(qr_path), 200, h - 480, 150, 150)
-    c.showPage()
-    c.save()
 
+def save_user(cursor, firebase_uid, email):
+    cursor.execute("""
+        INSERT INTO users (firebase_uid, email)
+        VALUES (%s, %s)
+        ON DUPLICATE KEY UPDATE email = VALUES(email)
+    """, (firebase_uid, email))
+
+
+def refresh_user_email(firebase_uid):
     try:
-        user_email = get_user_email(booking["firebase_uid"])
+        email = firebase_calls.call(auth.get_user, firebase_uid).email
 
-        send_ticket_email(
-            user_email,
-            "Parking Booking Confirmation",
-            f"""
-Your parking booking is confirmed.<br><br>
-<b>Ticket ID:</b> {booking['id']}<br>
-<b>Slot:</b> {booking['slot_no']}<br>
-<b>Location:</b> {booking['location']}
-""",
-            pdf_path
-        )
+        cached = user_cache.get(firebase_uid)
+        if not cached or cached[0] != email:
+            with get_db() as db, db.cursor() as cursor:
+                save_user(cursor, firebase_uid, email)
 
+        user_cache.set(firebase_uid, (email, time.time()))
     except Exception as e:
-        print("Auto email error:", e)
+        print("User refresh error:", e)
+    finally:
+        with _user_refreshing_lock:
+            _user_refreshing.discard(firebase_uid)
 
 
-# =========================================================
-# BOOKED SLOTS
-# =========================================================
-@app.route("/api/confirm-booking", methods=["POST"])
-def confirm_booking():
+def refresh_user_email_async(firebase_uid):
+    with _user_refreshing_lock:
+        if firebase_uid in _user_refreshing:
+            return
+        _user_refreshing.add(firebase_uid)
 
-    decoded, error = verify_token()
-    if error:
-        return jsonify({"error": error[0]}), error[1]
+    run_in_background(refresh_user_email, firebase_uid)
 
-    data = request.get_json()
 
-    db = get_db()
-    cursor = db.cursor()
+def get_user_email(firebase_uid, cursor=None):
+    """Email for a Firebase user. Pass `cursor` to reuse the caller's connection."""
+    cached = user_cache.get(firebase_uid)
+    if cached:
+        email, confirmed_at = cached
+        if time.time() - confirmed_at > USER_EMAIL_REFRESH_SECONDS:
+            refresh_user_email_async(firebase_uid)
+        return email
 
-    cursor.execute("""
-        INSERT INTO bookings
-        (firebase_uid, slot_no, vehicle_no, location,
-         latitude, longitude,
-         booking_date, created_at, entry_time)
-        VALUES (%s,%s,%s,%s,%s,%s,%s,NOW(),NOW())
-    """, (
-        decoded["uid"],
-        data["slot"],
-        data["vehicle"],
-        data["location"],
-        data["latitude"],
-        data["longitude"],
-        data["date"]
-    ))
+    if cursor is None:
+        with get_db() as db, db.cursor() as own_cursor:
+            return get_user_email(firebase_uid, own_cursor)
 
-    db.commit()
+    cursor.execute("SELECT email FROM users WHERE firebase_uid = %s", (firebase_uid,))
+    row = cursor.fetchone()
 
-    ticket_id = cursor.lastrowid
-    cursor.close()
-    db.close()
+    if row:
+        email = row["email"] if isinstance(row, dict) else row[0]
+        # Not yet confirmed with Firebase by this process: refresh off the hot path
+        user_cache.set(firebase_uid, (email, 0.0))
+        refresh_user_email_async(firebase_uid)
+        return email
 
-    # ✅ Generate PDF + Send Email
-    generate_ticket_pdf_and_send_email(ticket_id)
+    email = firebase_calls.call(auth.get_user, firebase_uid).email
+    save_user(cursor, firebase_uid, email)
+    user_cache.set(firebase_uid, (email, time.time()))
+    return email
 
-    return jsonify({
-        "success": True,
-        "ticket_id": ticket_id,
-        "download_url": request.url_root.rstrip("/") + f"/api/ticket-pdf/{ticket_id}"
-    }), 201
 
 # =========================================================
-# BOOKED SLOTS
+# ARTIFACT STORE (RENDERED TICKETS + QR CODES)
 # =========================================================
-@app.route("/api/booked-slots", methods=["GET"])
-def booked_slots():
-    date = request.args.get("date")
-    location = request.args.get("location")
-
-    if not date or not location:
-        return jsonify({"error": "Date and location required"}), 400
-
-    db = get_db()
-    cursor = db.cursor()
-
-    cursor.execute("""
-        SELECT slot_no FROM bookings
-        WHERE booking_date=%s AND location=%s AND exit_time IS NULL
-    """, (date, location))
+# Rendered PDFs and QR PNGs can be kept in an artifact store so other
+# workers and restarted processes reuse them instead of rendering again.
+#
+# ARTIFACT_STORE=none      render in memory only, keep nothing (default)
+# ARTIFACT_STORE=fs        files under ARTIFACT_DIR (default BASE_DIR)
+# ARTIFACT_STORE=memory    per-process, byte-capped (tests / benchmarks)
+#
+# The fs layout is <namespace>/<2-hex shard>/<name>. Writes go to a temp
+# file that is renamed into place, so readers never see half a PDF. Once
+# the store holds more than ARTIFACT_MAX_BYTES, a background sweep deletes
+# the least recently used files (mtime, bumped on every read) down to 90%
+# of the cap, and anything not used for ARTIFACT_MAX_AGE_HOURS (0 = no
+# age limit). KEEP_TICKET_FILES=1 still works and means ARTIFACT_STORE=fs.
+ARTIFACT_STORE = os.getenv("ARTIFACT_STORE") or (
+    "fs" if os.getenv("KEEP_TICKET_FILES", "0") == "1" else "none"
+)
+ARTIFACT_DIR = os.getenv("ARTIFACT_DIR")
+ARTIFACT_MAX_BYTES = int(os.getenv("ARTIFACT_MAX_BYTES", str(512 * 1024 * 1024)))
+ARTIFACT_MAX_AGE_HOURS = float(os.getenv("ARTIFACT_MAX_AGE_HOURS", "168"))
+ARTIFACT_SWEEP_SECONDS = 600
 
-    slots = [row[0] for row in cursor.fetchall()]
-    cursor.close()
-    db.close()
+_artifact_store = {"store": None, "pid": None}
+_artifact_store_lock = threading.Lock()
 
-    return jsonify({"slots": slots}), 200
 
-# =========================================================
-# HOURLY TICKET PDF (MAP QR + AUTO EMAIL)
-# =========================================================
-@app.route("/api/ticket-pdf/<int:ticket_id>", methods=["GET"])
-def ticket_pdf(ticket_id):
+class NullArtifactStore:
+    """ARTIFACT_STORE=none: nothing is kept."""
 
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM bookings WHERE id=%s", (ticket_id,))
-    booking = cursor.fetchone()
-    cursor.close()
-    db.close()
+    def get(self, namespace, name):
+        return None
 
-    if not booking:
-        return jsonify({"error": "Ticket not found"}), 404
+    def put(self, namespace, name, data):
+        pass
+
+    def stats(self):
+        return {"backend": "none"}
+
+
+class MemoryArtifactStore:
+    """Byte-capped LRU in this process, same interface as FileArtifactStore."""
+
+    def __init__(self, max_bytes, max_age=None):
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._data = OrderedDict()  # (namespace, name) -> (data, stored_at)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+    def get(self, namespace, name):
+        key = (namespace, name)
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and self.max_age and time.time() - item[1] > self.max_age:
+                self._remove(key)
+                item = None
+            if item is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, namespace, name, data):
+        key = (namespace, name)
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (data, time.time())
+            self._bytes += len(data)
+            self.writes += 1
+            while self._bytes > self.max_bytes and len(self._data) > 1:
+                self._remove(next(iter(self._data)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        data, _ = self._data.pop(key)
+        self._bytes -= len(data)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": "memory",
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "writes": self.writes,
+                "evictions": self.evictions,
+            }
+
+
+class FileArtifactStore:
+    """Sharded files under `root`, shared by every worker on the host.
+
+    Each process keeps its own estimate of the total size (exact after a
+    sweep, plus what it wrote since); the sweep itself always works from
+    the files on disk, so workers evicting at the same time is harmless.
+    """
+
+    def __init__(self, root, max_bytes, max_age=None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._bytes = None  # unknown until the first sweep
+        self._last_sweep = 0.0
+        self._sweeping = False
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+    def path(self, namespace, name):
+        shard = hashlib.sha256(name.encode()).hexdigest()[:2]
+        return os.path.join(self.root, namespace, shard, name)
+
+    def get(self, namespace, name):
+        path = self.path(namespace, name)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        try:
+            os.utime(path)  # mtime is the LRU order
+        except OSError:
+            pass  # evicted meanwhile, we already have the bytes
+
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put(self, namespace, name, data):
+        path = self.path(namespace, name)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print("Artifact store write error:", e)
+            return
+
+        with self._lock:
+            self.writes += 1
+            if self._bytes is not None:
+                self._bytes += len(data)
+            due = (
+                self._bytes is None
+                or self._bytes > self.max_bytes
+                or time.time() - self._last_sweep > ARTIFACT_SWEEP_SECONDS
+            )
+            if due and not self._sweeping:
+                self._sweeping = True
+                run_in_background(self.sweep)
+
+    def files(self):
+        """(mtime, size, path) of every stored file, plus stale temp files
+        and files left by the old flat layout (<dir>/<name>, no shard)."""
+        for namespace in os.scandir(self.root):
+            if not namespace.is_dir() or namespace.name not in ARTIFACT_SWEEP_DIRS:
+                continue
+            for entry in os.scandir(namespace.path):
+                entries = os.scandir(entry.path) if entry.is_dir() else (entry,)
+                for entry in entries:
+                    try:
+                        st = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    yield st.st_mtime, st.st_size, entry.path
+
+    def sweep(self):
+        try:
+            now = time.time()
+            files = []
+            for mtime, size, path in self.files():
+                if path.endswith(".tmp"):
+                    # Left behind by a worker that died mid-write
+                    if now - mtime > 3600:
+                        self._delete(path)
+                    continue
+                files.append((mtime, size, path))
+
+            files.sort()
+            total = sum(size for _, size, _ in files)
+            target = self.max_bytes * 0.9 if total > self.max_bytes else total
+            evicted = 0
+
+            for mtime, size, path in files:
+                expired = self.max_age and now - mtime > self.max_age
+                if total <= target and not expired:
+                    break
+                if self._delete(path):
+                    total -= size
+                    evicted += 1
+
+            with self._lock:
+                self._bytes = total
+                self.evictions += evicted
+        except OSError as e:
+            print("Artifact store sweep error:", e)
+        finally:
+            with self._lock:
+                self._last_sweep = time.time()
+                self._sweeping = False
+
+    @staticmethod
+    def _delete(path):
+        try:
+            os.remove(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": "fs",
+                "root": self.root,
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "writes": self.writes,
+                "evictions": self.evictions,
+            }
+
+
+# The store's namespaces, and monthly_qr_codes from before it: tickets and
+# QR codes used to be written flat under BASE_DIR, the sweep evicts those.
+ARTIFACT_SWEEP_DIRS = ("tickets", "monthly_tickets", "qr_codes", "monthly_qr_codes")
+
+ARTIFACT_BACKENDS = {
+    "none": lambda: NullArtifactStore(),
+    "memory": lambda: MemoryArtifactStore(ARTIFACT_MAX_BYTES, ARTIFACT_MAX_AGE_HOURS * 3600),
+    "fs": lambda: FileArtifactStore(
+        ARTIFACT_DIR or BASE_DIR, ARTIFACT_MAX_BYTES, ARTIFACT_MAX_AGE_HOURS * 3600
+    ),
+}
 
-    map_link = f"https://www.google.com/maps?q={booking['latitude']},{booking['longitude']}"
 
-    tickets_dir = os.path.join(BASE_DIR, "tickets")
-    qr_dir = os.path.join(BASE_DIR, "qr_codes")
-    os.makedirs(tickets_dir, exist_ok=True)
-    os.makedirs(qr_dir, exist_ok=True)
+def artifact_store():
+    """The configured store, created on first use (one per process)."""
+    if _artifact_store["pid"] == os.getpid():
+        return _artifact_store["store"]
 
-    pdf_path = os.path.join(tickets_dir, f"ticket_{ticket_id}.pdf")
-    qr_path = os.path.join(qr_dir, f"qr_{ticket_id}.png")
+    with _artifact_store_lock:
+        if _artifact_store["pid"] != os.getpid():
+            if ARTIFACT_STORE not in ARTIFACT_BACKENDS:
+                raise ValueError(
+                    f"ARTIFACT_STORE must be one of {', '.join(ARTIFACT_BACKENDS)}, got {ARTIFACT_STORE!r}"
+                )
+            _artifact_store["store"] = ARTIFACT_BACKENDS[ARTIFACT_STORE]()
+            _artifact_store["pid"] = os.getpid()
 
-    # Generate QR
-    qrcode.make(map_link).save(qr_path)
+    return _artifact_store["store"]
 
-    # Create PDF
-    c = canvas.Canvas(pdf_path, pagesize=A4)
-    w, h = A4
 
-    c.setFont("Helvetica-Bold", 20)
-    c.drawString(200, h - 80, "Parking Ticket")
+def load_or_render(namespace, name, render):
+    """Stored bytes for namespace/name, or render() them and store the result."""
+    store = artifact_store()
+    data = store.get(namespace, name)
+    if data is None:
+        data = render()
+        store.put(namespace, name, data)
+    return data
 
-    c.setFont("Helvetica", 12)
-    c.drawString(80, h - 140, f"Ticket ID: {booking['id']}")
-    c.drawString(80, h - 170, f"Slot No: {booking['slot_no']}")
-    c.drawString(80, h - 200, f"Vehicle No: {booking['vehicle_no']}")
-    c.drawString(80, h - 230, f"Location: {booking['location']}")
-    c.drawString(80, h - 260, f"Date: {booking['booking_date']}")
-    c.drawString(80, h - 290, f"Map: {map_link}")
-
-    c.drawImage(ImageReader(qr_path), 200, h - 480, 150, 150)
-    c.showPage()
-    c.save()
 
-    
+def render_qr_png(payload):
+    import qrcode
 
-    return send_file(pdf_path, as_attachment=True)
+    with timed("qr_render"):
+        buffer = BytesIO()
+        qrcode.make(payload).save(buffer)
+        return buffer.getvalue()
 
 
-# =========================================================
-# MONTHLY TICKET PDF (MAP QR)
-# =========================================================
-# =========================================================
-# CONFIRM MONTHLY BOOKING
-# =========================================================
-@app.route("/api/confirm-monthly-booking", methods=["POST"])
-def confirm_monthly_booking():
+# ---------------- QR CACHE ----------------
+# Every ticket QR encodes the Google Maps link of its location, and there
+# are only a handful of locations: cache the PNG by payload, in memory and
+# in the artifact store (so restarted workers start warm).
+QR_CACHE_SIZE = int(os.getenv("QR_CACHE_SIZE", "256"))
 
-    decoded, error = verify_token()
-    if error:
-        return jsonify({"error": error[0]}), error[1]
+qr_cache = LRUCache(QR_CACHE_SIZE)
 
-    data = request.get_json()
 
-    if not data:
-        return jsonify({"error": "No data received"}), 400
+def get_qr_png(payload):
+    key = hashlib.sha256(payload.encode()).hexdigest()[:32]
+    return qr_cache.get_or_create(
+        key, lambda: load_or_render("qr_codes", f"{key}.png", lambda: render_qr_png(payload))
+    )
 
-    # Validate required fields
-    required_fields = [
-        "customer_name",
-        "vehicle_no",
-        "phone_no",
-        "location",
-        "package_months",
-        "amount"
-    ]
 
-    for field in required_fields:
-        if not data.get(field):
-            return jsonify({"error": f"{field} is required"}), 400
+# =========================================================
+# TICKET TEMPLATES
+# =========================================================
+# The static parts of both layouts (title and labels, styles, table
+# styles, header band, captions, footer) are built once per process. A
+# render only stamps in the booking fields and the QR image.
+_ticket_templates = {"value": None}
+_ticket_templates_lock = threading.Lock()
 
-    try:
-        db = get_db()
-        cursor = db.cursor()
+HOURLY_LABELS = ("Ticket ID", "Slot No", "Vehicle No", "Location", "Date", "Map")
 
-        # ✅ Ensure user exists (Fix foreign key issue)
-        cursor.execute(
-            "SELECT firebase_uid FROM users WHERE firebase_uid = %s",
-            (decoded["uid"],)
-        )
-        existing_user = cursor.fetchone()
 
-        if not existing_user:
-            user_email = get_user_email(decoded["uid"])
+def ticket_templates():
+    if _ticket_templates["value"] is None:
+        with _ticket_templates_lock:
+            if _ticket_templates["value"] is None:
+                _ticket_templates["value"] = build_ticket_templates()
+    return _ticket_templates["value"]
 
-            cursor.execute("""
-                INSERT INTO users (firebase_uid, email)
-                VALUES (%s, %s)
-            """, (decoded["uid"], user_email))
 
-            db.commit()
+def build_ticket_templates():
+    from reportlab import rl_config
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.lib.units import inch
+    from reportlab.platypus import Flowable, Paragraph, TableStyle
 
-        # ✅ Get user email (for monthly booking table)
-        user_email = get_user_email(decoded["uid"])
+    # Streams are only zlib-compressed: skipping the ASCII85 pass over the
+    # QR bitmap is most of an hourly ticket's render time.
+    rl_config.useA85 = 0
 
-        # ✅ Calculate start and end date
-        start_date = datetime.now().date()
-        end_date = start_date + timedelta(days=int(data.get("package_months")) * 30)
+    class QRImage(Flowable):
+        """A QR ImageReader drawn at a fixed square size."""
 
-        # ✅ Insert monthly booking
-        cursor.execute("""
-            INSERT INTO monthly_bookings
-            (firebase_uid, customer_name, email, phone_no, vehicle_no, location,
-             latitude, longitude, package_months, amount,
-             start_date, end_date, created_at)
-            VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,NOW())
-        """, (
-            decoded["uid"],
-            data.get("customer_name"),
-            user_email,
-            data.get("phone_no"),
-            data.get("vehicle_no"),
-            data.get("location"),
-            data.get("latitude"),
-            data.get("longitude"),
-            data.get("package_months"),
-            data.get("amount"),
-            start_date,
-            end_date
-        ))
+        def __init__(self, reader, size):
+            super().__init__()
+            self.reader = reader
+            self.size = size
 
-        db.commit()
-        monthly_id = cursor.lastrowid
+        def wrap(self, avail_width, avail_height):
+            return self.size, self.size
 
-        cursor.close()
-        db.close()
+        def draw(self):
+            self.canv.drawImage(self.reader, 0, 0, self.size, self.size)
 
-        # Generate PDF + Send Email
-        generate_monthly_ticket_pdf_and_send_email(monthly_id)
+    normal = getSampleStyleSheet()["Normal"]
+    w, h = A4
 
-        return jsonify({
-            "success": True,
-            "monthly_id": monthly_id,
-            "amount": data.get("amount")
-        }), 201
+    return {
+        "hourly": {
+            "title": ("Parking Ticket", 200, h - 80),
+            "labels": [(f"{label}: ", h - 140 - 30 * i) for i, label in enumerate(HOURLY_LABELS)],
+            "qr": (200, h - 480, 150),
+        },
+        "monthly": {
+            "normal": normal,
+            "header": Paragraph(
+                "<font size=20 color='white'><b>ParkSmart Monthly Pass</b></font>", normal
+            ),
+            "header_style": TableStyle([
+                ("BACKGROUND", (0, 0), (-1, -1), colors.HexColor("#0f172a")),
+                ("ALIGN", (0, 0), (-1, -1), "CENTER"),
+                ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
+                ("TOPPADDING", (0, 0), (-1, -1), 18),
+                ("BOTTOMPADDING", (0, 0), (-1, -1), 18),
+            ]),
+            "details_style": TableStyle([
+                ("BACKGROUND", (0,0), (-1,-1), colors.whitesmoke),
+                ("GRID", (0,0), (-1,-1), 0.4, colors.HexColor("#d1d5db")),
+                ("FONTSIZE", (0,0), (-1,-1), 10),
+                ("LEFTPADDING", (0,0), (-1,-1), 8),
+                ("RIGHTPADDING", (0,0), (-1,-1), 8),
+                ("TOPPADDING", (0,0), (-1,-1), 6),
+                ("BOTTOMPADDING", (0,0), (-1,-1), 6),
+            ]),
+            "qr_style": TableStyle([("ALIGN", (0,0), (-1,-1), "CENTER")]),
+            "caption": Paragraph(
+                "<b>Scan to View Parking Location</b>",
+                ParagraphStyle(name="CenterQR", alignment=1)
+            ),
+            "map_link_style": ParagraphStyle(
+                name="MapLink", alignment=1, textColor=colors.blue, fontSize=9
+            ),
+            "footer": Paragraph(
+                "Thank you for choosing ParkSmart • support@parksmart.com",
+                ParagraphStyle(name="Footer", alignment=1, fontSize=8, textColor=colors.grey)
+            ),
+            "full_width": [6.7 * inch],
+            "id_status_widths": [3.3 * inch, 3.4 * inch],
+            "details_widths": [1.3*inch, 2.0*inch, 1.3*inch, 2.1*inch],
+            "qr_size": 2.5 * inch,
+            "QRImage": QRImage,
+        },
+    }
+
+
+def static_flowable(prototype):
+    """Per-render copy of a pre-parsed flowable (wrap() state is per copy)."""
+    return copy.copy(prototype)
+
+
+def qr_image_reader(qr_png):
+    """QR as 8-bit grey: a third of the data reportlab compresses as RGB."""
+    from PIL import Image as PILImage
+    from reportlab.lib.utils import ImageReader
+
+    return ImageReader(PILImage.open(BytesIO(qr_png)).convert("L"))
 
-    except Exception as e:
-        print("Monthly Booking Error:", e)
-        return jsonify({"error": "Internal Server Error"}), 500
 
 # =========================================================
-# GENERATE MONTHLY TICKET PDF + SEND EMAIL (MODERN SINGLE PAGE)
+# HOURLY TICKET RENDERING (+ DOWNLOAD CACHE)
 # =========================================================
-def generate_monthly_ticket_pdf_and_send_email(monthly_id):
-
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM monthly_bookings WHERE id=%s", (monthly_id,))
-    booking = cursor.fetchone()
-    cursor.close()
-    db.close()
-
-    if not booking:
-        return None
+# Bookings never change after creation, so a rendered ticket can be reused
+# for as long as the fields printed on it stay the same.
+TICKET_CACHE_SIZE = int(os.getenv("TICKET_CACHE_SIZE", "512"))
+ticket_cache = LRUCache(TICKET_CACHE_SIZE)
 
-    map_link = f"https://www.google.com/maps?q={booking['latitude']},{booking['longitude']}"
+TICKET_FIELDS = ("id", "slot_no", "vehicle_no", "location", "booking_date", "latitude", "longitude")
+TICKET_LAYOUT_VERSION = "hourly-v2"
 
-    monthly_dir = os.path.join(BASE_DIR, "monthly_tickets")
-    qr_dir = os.path.join(BASE_DIR, "monthly_qr_codes")
-    os.makedirs(monthly_dir, exist_ok=True)
-    os.makedirs(qr_dir, exist_ok=True)
 
-    pdf_path = os.path.join(monthly_dir, f"monthly_ticket_{monthly_id}.pdf")
-    qr_path = os.path.join(qr_dir, f"monthly_qr_{monthly_id}.png")
+def ticket_etag(booking):
+    raw = "|".join(str(booking[field]) for field in TICKET_FIELDS)
+    return hashlib.sha256(f"{TICKET_LAYOUT_VERSION}|{raw}".encode()).hexdigest()[:32]
 
-    qrcode.make(map_link).save(qr_path)
 
-    # =========================
-    # 📄 MODERN SINGLE PAGE PDF
-    # =========================
-    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Image
-    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-    from reportlab.lib import colors
-    from reportlab.lib.units import inch
+def render_ticket_pdf(booking):
+    """Render the hourly ticket and return the PDF bytes (no temp files)."""
+    from reportlab.pdfgen import canvas
     from reportlab.lib.pagesizes import A4
 
-    doc = SimpleDocTemplate(
-        pdf_path,
-        pagesize=A4,
-        rightMargin=30,
-        leftMargin=30,
-        topMargin=30,
-        bottomMargin=30
-    )
+    with timed("pdf_render"):
+        pdf_buffer = BytesIO()
+        c = canvas.Canvas(pdf_buffer, pagesize=A4)
+        draw_ticket_page(c, booking)
+        c.save()
 
-    styles = getSampleStyleSheet()
-    elements = []
+    return pdf_buffer.getvalue()
 
-    # ===== HEADER BAR =====
-    header_data = [[
-        Paragraph(
-            "<font size=20 color='white'><b>ParkSmart Monthly Pass</b></font>",
-            styles["Normal"]
-        )
-    ]]
-
-    header_table = Table(header_data, colWidths=[6.7 * inch])
-    header_table.setStyle(TableStyle([
-        ("BACKGROUND", (0, 0), (-1, -1), colors.HexColor("#0f172a")),
-        ("ALIGN", (0, 0), (-1, -1), "CENTER"),
-        ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
-        ("TOPPADDING", (0, 0), (-1, -1), 18),
-        ("BOTTOMPADDING", (0, 0), (-1, -1), 18),
-    ]))
-
-    elements.append(header_table)
-    elements.append(Spacer(1, 15))
 
-    # ===== TICKET ID + STATUS =====
-    status_color = "#16a34a" if booking.get("payment_status", "Paid") == "Paid" else "#dc2626"
+def render_tickets_pdf(bookings):
+    """One multi-page PDF, one hourly ticket per page (bulk bookings)."""
+    from reportlab.pdfgen import canvas
+    from reportlab.lib.pagesizes import A4
 
-    id_status_table = Table([[
-        Paragraph(f"<b>Ticket ID:</b> #{booking['id']}", styles["Normal"]),
-        Paragraph(f"<b>Status:</b> <font color='{status_color}'>PAID</font>", styles["Normal"])
-    ]], colWidths=[3.3 * inch, 3.4 * inch])
+    with timed("pdf_render"):
+        pdf_buffer = BytesIO()
+        c = canvas.Canvas(pdf_buffer, pagesize=A4)
+        for booking in bookings:
+            draw_ticket_page(c, booking)
+        c.save()
+    return pdf_buffer.getvalue()
 
-    elements.append(id_status_table)
-    elements.append(Spacer(1, 15))
 
-    # ===== COMPACT DETAILS GRID =====
-    data = [
-        ["Customer", booking["customer_name"], "Vehicle", booking["vehicle_no"]],
-        ["Phone", booking["phone_no"], "Location", booking["location"]],
-        ["Duration", f"{booking['package_months']} Months", "Amount", f"₹ {booking['amount']}"],
-        ["Start", str(booking["start_date"]), "End", str(booking["end_date"])],
-    ]
+def draw_ticket_page(c, booking):
+    map_link = f"https://www.google.com/maps?q={booking['latitude']},{booking['longitude']}"
 
-    details_table = Table(data, colWidths=[1.3*inch, 2.0*inch, 1.3*inch, 2.1*inch])
+    qr_png = get_qr_png(map_link)
 
-    details_table.setStyle(TableStyle([
-        ("BACKGROUND", (0,0), (-1,-1), colors.whitesmoke),
-        ("GRID", (0,0), (-1,-1), 0.4, colors.HexColor("#d1d5db")),
-        ("FONTSIZE", (0,0), (-1,-1), 10),
-        ("LEFTPADDING", (0,0), (-1,-1), 8),
-        ("RIGHTPADDING", (0,0), (-1,-1), 8),
-        ("TOPPADDING", (0,0), (-1,-1), 6),
-        ("BOTTOMPADDING", (0,0), (-1,-1), 6),
-    ]))
+    template = ticket_templates()["hourly"]
 
-    elements.append(details_table)
-    elements.append(Spacer(1, 20))
+    title, x, y = template["title"]
+    c.setFont("Helvetica-Bold", 20)
+    c.drawString(x, y, title)
 
-    # ===== QR SECTION =====
-    elements.append(Paragraph(
-        "<b>Scan to View Parking Location</b>",
-        ParagraphStyle(name="CenterQR", alignment=1)
-    ))
+    # Label and value stay one string so the text copies out as before
+    values = (
+        booking["id"], booking["slot_no"], booking["vehicle_no"],
+        booking["location"], booking["booking_date"], map_link
+    )
+    c.setFont("Helvetica", 12)
+    for (label, y), value in zip(template["labels"], values):
+        c.drawString(80, y, f"{label}{value}")
 
-    elements.append(Spacer(1, 10))
+    x, y, size = template["qr"]
+    c.drawImage(qr_image_reader(qr_png), x, y, size, size)
+    c.showPage()
 
-    qr_image = Image(qr_path, width=2.5 * inch, height=2.5 * inch)
-    qr_wrapper = Table([[qr_image]], colWidths=[6.7 * inch])
-    qr_wrapper.setStyle(TableStyle([
-        ("ALIGN", (0,0), (-1,-1), "CENTER")
-    ]))
 
-    elements.append(qr_wrapper)
-    elements.append(Spacer(1, 10))
+def get_ticket_pdf_bytes(booking):
+    """Return (etag, pdf bytes), rendering at most once per etag per process."""
+    etag = ticket_etag(booking)
+    name = f"ticket_{booking['id']}_{etag}.pdf"
+    return etag, ticket_cache.get_or_create(
+        etag, lambda: load_or_render("tickets", name, lambda: render_ticket_pdf(booking))
+    )
 
-    elements.append(Paragraph(
-        f'<a href="{map_link}">Open Location in Google Maps</a>',
-        ParagraphStyle(name="MapLink", alignment=1, textColor=colors.blue, fontSize=9)
-    ))
 
-    elements.append(Spacer(1, 20))
+# ================= ADD THIS FUNCTION HERE =================
 
-    # ===== FOOTER =====
-    elements.append(Paragraph(
-        "Thank you for choosing ParkSmart • support@parksmart.com",
-        ParagraphStyle(name="Footer", alignment=1, fontSize=8, textColor=colors.grey)
-    ))
+def generate_ticket_pdf_and_send_email(ticket_id):
+    with get_db() as db, db.cursor(dictionary=True) as cursor:
+        cursor.execute("SELECT * FROM bookings WHERE id=%s", (ticket_id,))
+        booking = cursor.fetchone()
 
-    # Build PDF
-    doc.build(elements)
+    if not booking:
+        return
+
+    # Goes through the download cache, the user usually opens the ticket right away
+    etag, pdf_bytes = get_ticket_pdf_bytes(booking)
 
-    # =========================
-    # 📧 SEND EMAIL
-    # =========================
     try:
         user_email = get_user_email(booking["firebase_uid"])
 
         send_ticket_email(
             user_email,
-            "Monthly Parking Pass Confirmation",
+            "Parking Booking Confirmation",
             f"""
-Your monthly parking pass is confirmed.<br><br>
+Your parking booking is confirmed.<br><br>
 <b>Ticket ID:</b> {booking['id']}<br>
-<b>Location:</b> {booking['location']}<br>
-<b>Package:</b> {booking['package_months']} Months<br>
-<b>Amount Paid:</b> ₹{booking['amount']}<br><br>
+<b>Slot:</b> {booking['slot_no']}<br>
+<b>Location:</b> {booking['location']}
+""",
+            attachment=(f"ticket_{booking['id']}.pdf", pdf_bytes),
+            idempotency_key=f"ticket:{booking['id']}"
+        )
+
+    except Exception as e:
+        print("Auto email error:", e)
+        raise  # let the job queue retry
+
+
+# =========================================================
+# IDEMPOTENCY KEYS
+# =========================================================
+# Clients may send `Idempotency-Key: <random string>` with a booking POST
+# and reuse it when they retry. The first request with a key claims it in
+# `idempotency_keys` (migrations/006_idempotency_keys.sql) and stores its
+# response there; a retry gets that response back (with
+# `Idempotent-Replayed: true`) without running the endpoint again, so no
+# second booking, PDF or email. A retry that arrives while the first is
+# still running waits up to IDEMPOTENCY_WAIT_SECONDS for it.
+#
+# Keys are scoped per user and endpoint and kept IDEMPOTENCY_TTL_HOURS.
+# Responses >= 500 are not stored, the key is released for a retry. A
+# claim left behind by a crashed worker is taken over after
+# IDEMPOTENCY_PENDING_SECONDS.
+IDEMPOTENCY_TTL_HOURS = int(os.getenv("IDEMPOTENCY_TTL_HOURS", "24"))
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "10"))
+IDEMPOTENCY_PENDING_SECONDS = int(os.getenv("IDEMPOTENCY_PENDING_SECONDS", "60"))
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "4096"))
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+IDEMPOTENCY_PURGE_SECONDS = 600
+
+# (uid, endpoint, key) -> (request_hash, status_code, body) of finished requests
+idempotency_cache = LRUCache(IDEMPOTENCY_CACHE_SIZE, ttl=IDEMPOTENCY_TTL_HOURS * 3600)
+_idempotency_inflight = {}  # (uid, endpoint, key) -> Event, requests running in this process
+_idempotency_lock = threading.Lock()
+_idempotency_purge = {"at": time.time()}
+
+
+def idempotent(fn):
+    """Make a POST endpoint replay its stored response for a repeated Idempotency-Key."""
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get("Idempotency-Key")
+        if not key:
+            return fn(*args, **kwargs)
+
+        if len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            return jsonify({"error": f"Idempotency-Key longer than {IDEMPOTENCY_KEY_MAX_LENGTH} characters"}), 400
+
+        decoded, error = verify_token()
+        if error:
+            return fn(*args, **kwargs)  # answers the 401 / 503 itself
+
+        scope = (decoded["uid"], request.endpoint, key)
+        request_hash = hashlib.sha256(request.get_data()).hexdigest()
+
+        # Duplicates within this process wait on an Event, across processes
+        # on the MySQL row
+        while True:
+            stored = idempotency_cache.get(scope)
+            if stored is not None:
+                return idempotent_replay(stored, request_hash)
+
+            with _idempotency_lock:
+                running = _idempotency_inflight.get(scope)
+                if running is None:
+                    running = _idempotency_inflight[scope] = threading.Event()
+                    break
+
+            if not running.wait(IDEMPOTENCY_WAIT_SECONDS):
+                return idempotent_in_progress()
+
+        claimed = False
+        try:
+            claimed, stored = claim_idempotency_key(scope, request_hash)
+            if stored is not None:
+                idempotency_cache.set(scope, stored)
+                return idempotent_replay(stored, request_hash)
+            if not claimed:
+                return idempotent_in_progress()
+
+            response = app.make_response(fn(*args, **kwargs))
+
+            if response.status_code < 500 and response.is_json:
+                stored = (request_hash, response.status_code, response.get_data(as_text=True))
+                save_idempotent_response(scope, stored)
+                idempotency_cache.set(scope, stored)
+                claimed = False
+
+            return response
+        finally:
+            if claimed:
+                release_idempotency_key(scope)
+            with _idempotency_lock:
+                _idempotency_inflight.pop(scope, None)
+            running.set()
+
+    return wrapper
+
+
+def idempotent_replay(stored, request_hash):
+    stored_hash, status_code, body = stored
+    if stored_hash != request_hash:
+        return jsonify({"error": "Idempotency-Key was already used with a different request"}), 422
+
+    metrics.inc("parksmart_idempotent_replays_total", (request.endpoint,))
+    response = app.response_class(body, status=status_code, mimetype="application/json")
+    response.headers["Idempotent-Replayed"] = "true"
+    return response
+
+
+def idempotent_in_progress():
+    response = jsonify({"error": "A request with this Idempotency-Key is still in progress, retry shortly"})
+    response.headers["Retry-After"] = "1"
+    return response, 409
+
+
+def claim_idempotency_key(scope, request_hash):
+    """Returns (claimed, stored): claimed=True if this request owns the key,
+    stored=(request_hash, status_code, body) if it already has a response,
+    both empty if another request still held it after IDEMPOTENCY_WAIT_SECONDS.
+    """
+    uid, endpoint, key = scope
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+
+    while True:
+        with get_db() as db, db.cursor(dictionary=True) as cursor:
+            purge_idempotency_keys(cursor)
+
+            try:
+                cursor.execute("""
+                    INSERT INTO idempotency_keys
+                    (firebase_uid, endpoint, idem_key, request_hash, created_at, expires_at)
+                    VALUES (%s, %s, %s, %s, NOW(), NOW() + INTERVAL %s HOUR)
+                """, (uid, endpoint, key, request_hash, IDEMPOTENCY_TTL_HOURS))
+                return True, None
+            except mysql.connector.IntegrityError as e:
+                if e.errno != errorcode.ER_DUP_ENTRY:
+                    raise
+
+            cursor.execute("""
+                SELECT request_hash, status_code, response, created_at,
+                       expires_at < NOW() AS expired,
+                       created_at < NOW() - INTERVAL %s SECOND AS abandoned
+                FROM idempotency_keys
+                WHERE firebase_uid=%s AND endpoint=%s AND idem_key=%s
+            """, (IDEMPOTENCY_PENDING_SECONDS, uid, endpoint, key))
+            row = cursor.fetchone()
+
+            if row is None:
+                continue  # released in the meantime, claim it again
+
+            if row["expired"] or (row["status_code"] is None and row["abandoned"]):
+                # Only delete the row we looked at, not a newer claim
+                cursor.execute("""
+                    DELETE FROM idempotency_keys
+                    WHERE firebase_uid=%s AND endpoint=%s AND idem_key=%s AND created_at=%s
+                """, (uid, endpoint, key, row["created_at"]))
+                continue
+
+            if row["status_code"] is not None:
+                return False, (row["request_hash"], row["status_code"], row["response"])
+
+        if time.monotonic() > deadline:
+            return False, None
+
+        time.sleep(0.1)
+
+
+def save_idempotent_response(scope, stored):
+    _, status_code, body = stored
+    with get_db() as db, db.cursor() as cursor:
+        cursor.execute("""
+            UPDATE idempotency_keys SET status_code=%s, response=%s
+            WHERE firebase_uid=%s AND endpoint=%s AND idem_key=%s
+        """, (status_code, body) + scope)
+
+
+def release_idempotency_key(scope):
+    try:
+        with get_db() as db, db.cursor() as cursor:
+            cursor.execute("""
+                DELETE FROM idempotency_keys
+                WHERE firebase_uid=%s AND endpoint=%s AND idem_key=%s AND status_code IS NULL
+            """, scope)
+    except Exception as e:
+        # The claim is taken over after IDEMPOTENCY_PENDING_SECONDS anyway
+        print("Idempotency key release error:", e)
+
+
+def purge_idempotency_keys(cursor):
+    if time.time() - _idempotency_purge["at"] < IDEMPOTENCY_PURGE_SECONDS:
+        return
+    _idempotency_purge["at"] = time.time()
+
+    cursor.execute("DELETE FROM idempotency_keys WHERE expires_at < NOW() LIMIT 5000")
+
+
+# =========================================================
+# BOOKED SLOTS
+# =========================================================
+@app.route("/api/confirm-booking", methods=["POST"])
+@idempotent
+def confirm_booking():
+
+    decoded, error = verify_token()
+    if error:
+        return jsonify({"error": error[0]}), error[1]
+
+    data = request.get_json()
+
+    with get_db() as db, db.cursor() as cursor:
+        db.start_transaction()
+
+        # No read-then-insert: uniq_bookings_active_slot decides who wins
+        # a slot two requests race for (migrations/005_active_slot_unique.sql)
+        try:
+            cursor.execute("""
+                INSERT INTO bookings
+                (firebase_uid, slot_no, vehicle_no, location,
+                 latitude, longitude,
+                 booking_date, created_at, entry_time)
+                VALUES (%s,%s,%s,%s,%s,%s,%s,NOW(),NOW())
+            """, (
+                decoded["uid"],
+                data["slot"],
+                data["vehicle"],
+                data["location"],
+                data["latitude"],
+                data["longitude"],
+                data["date"]
+            ))
+        except mysql.connector.IntegrityError as e:
+            if not is_slot_conflict(e):
+                raise
+            db.rollback()
+            return slot_conflict_response(cursor, [data])
+
+        ticket_id = cursor.lastrowid
+
+        # ✅ PDF + email are sent by the job worker once this commits
+        job_id = enqueue_job(cursor, "ticket_email", {"ticket_id": ticket_id}, decoded["uid"])
+        record_slot_change(cursor, data["location"], data["date"], data["slot"], occupied=True)
+
+        db.commit()
+
+    mark_slot(data["location"], data["date"], data["slot"], occupied=True)
+
+    wake_job_worker()
+
+    return jsonify({
+        "success": True,
+        "ticket_id": ticket_id,
+        "job_id": job_id,
+        "download_url": request.url_root.rstrip("/") + f"/api/ticket-pdf/{ticket_id}"
+    }), 201
+
+# =========================================================
+# SLOT OCCUPANCY INDEX
+# =========================================================
+# Occupied slots per (location, date) are kept in memory and updated by
+# confirm_booking / admin_revoke_booking. Each entry is re-read from MySQL
+# every SLOT_INDEX_RECONCILE_SECONDS, so bookings made through other
+# gunicorn workers show up within that window.
+SLOT_INDEX_RECONCILE_SECONDS = float(os.getenv("SLOT_INDEX_RECONCILE_SECONDS", "5"))
+SLOT_INDEX_SIZE = int(os.getenv("SLOT_INDEX_SIZE", "1024"))
+
+slot_index = LRUCache(SLOT_INDEX_SIZE, ttl=SLOT_INDEX_RECONCILE_SECONDS)
+_slot_index_lock = threading.Lock()
+
+
+def slot_value(slot):
+    # JSON bodies may send "12" where MySQL gives back 12
+    if isinstance(slot, str) and slot.isdigit():
+        return int(slot)
+    return slot
+
+
+def load_occupied_slots(location, date):
+    with get_db() as db, db.cursor() as cursor:
+        return query_occupied_slots(cursor, location, date)
+
+
+def query_occupied_slots(cursor, location, date):
+    cursor.execute("""
+        SELECT slot_no FROM bookings
+        WHERE booking_date=%s AND location=%s AND exit_time IS NULL
+    """, (date, location))
+
+    return {slot_value(row[0]) for row in cursor.fetchall()}
+
+
+def get_occupied_slots(location, date):
+    key = (location, str(date))
+    slots = slot_index.get_or_create(key, lambda: load_occupied_slots(location, date))
+
+    with _slot_index_lock:
+        return sorted(slots, key=lambda slot: (isinstance(slot, str), slot))
+
+
+def mark_slot(location, date, slot, occupied):
+    slots = slot_index.get((location, str(date)))
+    if slots is None:
+        return  # not cached here, next read loads it from MySQL
+
+    with _slot_index_lock:
+        if occupied:
+            slots.add(slot_value(slot))
+        else:
+            slots.discard(slot_value(slot))
+
+
+# ---------------- SLOT CONFLICTS ----------------
+# Two check-ins racing for one slot are settled by the unique key on
+# active bookings: the second INSERT fails with ER_DUP_ENTRY and gets a
+# 409 listing free slots nearby, so the client can retry right away.
+# Slots are numbered 1..SLOTS_PER_LOCATION.
+SLOTS_PER_LOCATION = int(os.getenv("SLOTS_PER_LOCATION", "50"))
+SLOT_ALTERNATIVES = int(os.getenv("SLOT_ALTERNATIVES", "5"))
+
+
+def is_slot_conflict(err):
+    return err.errno == errorcode.ER_DUP_ENTRY
+
+
+def refresh_occupied_slots(cursor, location, date):
+    # The cached set missed a booking (made through another worker),
+    # re-read it instead of waiting for the reconcile TTL
+    slots = query_occupied_slots(cursor, location, date)
+    slot_index.set((location, str(date)), slots)
+    return slots
+
+
+def free_slots_near(slot, occupied, limit=SLOT_ALTERNATIVES):
+    free = [s for s in range(1, SLOTS_PER_LOCATION + 1) if s not in occupied]
+    slot = slot_value(slot)
+    if isinstance(slot, int):
+        free.sort(key=lambda s: (abs(s - slot), s))
+    return free[:limit]
+
+
+def slot_conflict_response(cursor, items):
+    """409 for a failed booking INSERT: which requested slots are taken, with alternatives.
+
+    Reads through the caller's cursor (after its rollback) rather than
+    checking out a second pooled connection.
+    """
+    occupied = {}
+    conflicts = []
+
+    for item in items:
+        key = (item["location"], str(item["date"]))
+        if key not in occupied:
+            occupied[key] = refresh_occupied_slots(cursor, item["location"], item["date"])
+
+        if slot_value(item["slot"]) not in occupied[key]:
+            continue
+
+        # Don't offer slots that other items of this request ask for
+        wanted = {slot_value(other["slot"]) for other in items
+                  if (other["location"], str(other["date"])) == key}
+        conflicts.append({
+            "slot": item["slot"],
+            "location": item["location"],
+            "date": str(item["date"]),
+            "free_slots": free_slots_near(item["slot"], occupied[key] | wanted),
+        })
+
+    metrics.inc("parksmart_slot_conflicts_total", ())
+
+    if len(items) == 1:
+        conflict = conflicts[0] if conflicts else {"slot": items[0]["slot"], "free_slots": []}
+        return jsonify({
+            "error": "Slot already booked",
+            "slot": conflict["slot"],
+            "free_slots": conflict["free_slots"],
+        }), 409
+
+    return jsonify({"error": "Some slots are already booked", "conflicts": conflicts}), 409
+
+
+# =========================================================
+# LIVE SLOT UPDATES (SERVER-SENT EVENTS)
+# =========================================================
+# Every booking / revoke writes a row to `slot_events` in its own
+# transaction (migrations/003_slot_events.sql). Each gunicorn worker runs
+# one listener thread that tails that table and fans new rows out to the
+# SSE clients connected to it, and into its slot index.
+#
+# Each open stream holds a worker thread: run gunicorn with gthread
+# workers (see gunicorn.conf.py) rather than plain sync workers. Past
+# SSE_MAX_STREAMS open streams a worker answers 503, and the client polls
+# /api/booked-slots instead.
+#
+# Thread budget per worker: GUNICORN_THREADS (default 64) = SSE_MAX_STREAMS
+# + SSE_REQUEST_THREADS (default 16) for everything else, so raising
+# GUNICORN_THREADS raises the stream cap with it. A waiting stream is a
+# thread blocked on a queue: no CPU and no DB connection.
+SLOT_EVENTS_POLL_SECONDS = float(os.getenv("SLOT_EVENTS_POLL_SECONDS", "1"))
+SLOT_EVENTS_KEEP_HOURS = int(os.getenv("SLOT_EVENTS_KEEP_HOURS", "24"))
+SSE_HEARTBEAT_SECONDS = 15
+SSE_MAX_SECONDS = int(os.getenv("SSE_MAX_SECONDS", "300"))
+# Threads per worker kept for bookings, downloads etc. whatever the streams do
+SSE_REQUEST_THREADS = int(os.getenv("SSE_REQUEST_THREADS", "16"))
+SSE_MAX_STREAMS = int(os.getenv(
+    "SSE_MAX_STREAMS", str(max(0, int(os.getenv("GUNICORN_THREADS", "64")) - SSE_REQUEST_THREADS))
+))
+SSE_BUSY_RETRY_SECONDS = 30
+
+_sse_streams = threading.BoundedSemaphore(SSE_MAX_STREAMS)
+
+_slot_subscribers = {}  # (location, date) -> set of queues
+_slot_subscribers_lock = threading.Lock()
+_slot_listener_pid = None
+
+
+def record_slot_change(cursor, location, date, slot, occupied):
+    record_slot_changes(cursor, [(location, date, slot)], occupied)
+
+
+def record_slot_changes(cursor, slots, occupied):
+    """slots: iterable of (location, date, slot_no)."""
+    cursor.executemany("""
+        INSERT INTO slot_events (location, booking_date, slot_no, occupied)
+        VALUES (%s, %s, %s, %s)
+    """, [(location, date, str(slot), 1 if occupied else 0) for location, date, slot in slots])
+
+
+def publish_slot_change(location, date, slot, occupied):
+    mark_slot(location, date, slot, occupied)
+
+    with _slot_subscribers_lock:
+        queues = list(_slot_subscribers.get((location, str(date)), ()))
+
+    event = {"slot": slot_value(slot), "occupied": bool(occupied)}
+    for q in queues:
+        q.put(event)
+
+
+def listen_slot_events():
+    last_id = None
+    last_cleanup = time.time()
+
+    while True:
+        try:
+            with get_db() as db, db.cursor() as cursor:
+                if last_id is None:
+                    # Start at the current end of the feed (retried until MySQL answers)
+                    cursor.execute("SELECT COALESCE(MAX(id), 0) FROM slot_events")
+                    last_id = cursor.fetchone()[0]
+
+                cursor.execute("""
+                    SELECT id, location, booking_date, slot_no, occupied
+                    FROM slot_events
+                    WHERE id > %s
+                    ORDER BY id
+                    LIMIT 500
+                """, (last_id,))
+                events = cursor.fetchall()
+
+                if time.time() - last_cleanup > 600:
+                    cursor.execute("""
+                        DELETE FROM slot_events
+                        WHERE created_at < NOW() - INTERVAL %s HOUR
+                        LIMIT 5000
+                    """, (SLOT_EVENTS_KEEP_HOURS,))
+                    last_cleanup = time.time()
+
+            for event_id, location, date, slot, occupied in events:
+                publish_slot_change(location, date, slot, occupied)
+                last_id = event_id
+
+            if len(events) == 500:
+                continue
+        except Exception as e:
+            print("Slot event listener error:", e)
+
+        time.sleep(SLOT_EVENTS_POLL_SECONDS)
+
+
+def start_slot_listener():
+    global _slot_listener_pid
+
+    with _slot_subscribers_lock:
+        if _slot_listener_pid == os.getpid():
+            return
+        _slot_listener_pid = os.getpid()
+
+    threading.Thread(target=listen_slot_events, name="slot-events", daemon=True).start()
+
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.route("/api/booked-slots/stream", methods=["GET"])
+def booked_slots_stream():
+    date = request.args.get("date")
+    location = request.args.get("location")
+
+    if not date or not location:
+        return jsonify({"error": "Date and location required"}), 400
+
+    if not _sse_streams.acquire(blocking=False):
+        # Every stream holds a worker thread: past the cap, tell EventSource
+        # to stop (non-200) so the page falls back to polling /api/booked-slots
+        response = app.response_class(
+            f"retry: {SSE_BUSY_RETRY_SECONDS * 1000}\n\n", status=503, mimetype="text/event-stream"
+        )
+        response.headers["Retry-After"] = str(SSE_BUSY_RETRY_SECONDS)
+        return response
+
+    key = (location, date)
+    start_slot_listener()
+
+    def stream():
+        # Registered here, not in the view: a stream that is never
+        # started never reaches the finally below
+        events = queue.Queue()
+        with _slot_subscribers_lock:
+            _slot_subscribers.setdefault(key, set()).add(events)
+
+        try:
+            yield "retry: 3000\n\n"
+            yield sse("snapshot", {"slots": get_occupied_slots(location, date)})
+
+            # Streams end after SSE_MAX_SECONDS; EventSource reconnects by
+            # itself and gets a fresh snapshot.
+            deadline = time.time() + SSE_MAX_SECONDS
+            while time.time() < deadline:
+                try:
+                    yield sse("slot", events.get(timeout=SSE_HEARTBEAT_SECONDS))
+                except queue.Empty:
+                    yield ": ping\n\n"
+        finally:
+            with _slot_subscribers_lock:
+                subscribers = _slot_subscribers.get(key)
+                if subscribers is not None:
+                    subscribers.discard(events)
+                    if not subscribers:
+                        del _slot_subscribers[key]
+
+    response = app.response_class(stream(), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    response.call_on_close(_sse_streams.release)
+    return response
+
+
+# =========================================================
+# BOOKED SLOTS
+# =========================================================
+@app.route("/api/booked-slots", methods=["GET"])
+def booked_slots():
+    date = request.args.get("date")
+    location = request.args.get("location")
+
+    if not date or not location:
+        return jsonify({"error": "Date and location required"}), 400
+
+    return jsonify({"slots": get_occupied_slots(location, date)}), 200
+
+# =========================================================
+# BULK BOOKING (FLEET / EVENTS)
+# =========================================================
+# POST {"bookings": [{slot, vehicle, location, latitude, longitude, date}, ...]}
+# All rows go in with one multi-row INSERT in one transaction; the tickets
+# are rendered into one multi-page PDF and sent in one email.
+BULK_BOOKING_MAX = int(os.getenv("BULK_BOOKING_MAX", "100"))
+BOOKING_FIELDS = ("slot", "vehicle", "location", "latitude", "longitude", "date")
+
+
+@app.route("/api/confirm-bookings", methods=["POST"])
+@idempotent
+def confirm_bookings():
+
+    decoded, error = verify_token()
+    if error:
+        return jsonify({"error": error[0]}), error[1]
+
+    data = request.get_json(silent=True)
+    items = data.get("bookings") if isinstance(data, dict) else data
+
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "bookings list required"}), 400
+
+    if len(items) > BULK_BOOKING_MAX:
+        return jsonify({"error": f"At most {BULK_BOOKING_MAX} bookings per request"}), 400
+
+    for i, item in enumerate(items):
+        missing = [f for f in BOOKING_FIELDS if not isinstance(item, dict) or item.get(f) in (None, "")]
+        if missing:
+            return jsonify({"error": f"bookings[{i}]: {', '.join(missing)} required"}), 400
+
+    # One form of each date from here on: MySQL takes 2026-1-5 but hands
+    # back 2026-01-05, and the duplicate check, the read-back and the slot
+    # index all compare them as keys.
+    try:
+        items = [
+            {**item, "date": datetime.strptime(str(item["date"]), "%Y-%m-%d").date()} for item in items
+        ]
+    except ValueError as e:
+        return jsonify({"error": f"Invalid date: {e}"}), 400
+
+    seen = set()
+    for i, item in enumerate(items):
+        key = (item["location"], item["date"], slot_value(item["slot"]))
+        if key in seen:
+            return jsonify({"error": f"bookings[{i}]: slot {item['slot']} listed twice"}), 400
+        seen.add(key)
+
+    with get_db() as db, db.cursor() as cursor:
+        db.start_transaction()
+
+        # executemany turns this into a single multi-row INSERT; one taken
+        # slot fails the whole statement and nothing is booked
+        try:
+            cursor.executemany("""
+                INSERT INTO bookings
+                (firebase_uid, slot_no, vehicle_no, location,
+                 latitude, longitude,
+                 booking_date, created_at, entry_time)
+                VALUES (%s,%s,%s,%s,%s,%s,%s,NOW(),NOW())
+            """, [(
+                decoded["uid"],
+                item["slot"],
+                item["vehicle"],
+                item["location"],
+                item["latitude"],
+                item["longitude"],
+                item["date"]
+            ) for item in items])
+        except mysql.connector.IntegrityError as e:
+            if not is_slot_conflict(e):
+                raise
+            db.rollback()
+            return slot_conflict_response(cursor, items)
+
+        # lastrowid is the first id of the multi-row INSERT. The others are
+        # read back rather than assumed consecutive (auto_increment_increment
+        # may not be 1); an active slot has one booking, so slot -> id is exact.
+        cursor.execute("""
+            SELECT id, location, booking_date, slot_no FROM bookings
+            WHERE id >= %s AND firebase_uid = %s AND exit_time IS NULL
+        """, (cursor.lastrowid, decoded["uid"]))
+        inserted = {
+            (location, booking_date, slot_value(slot)): booking_id
+            for booking_id, location, booking_date, slot in cursor.fetchall()
+        }
+        ticket_ids = [
+            inserted[(item["location"], item["date"], slot_value(item["slot"]))] for item in items
+        ]
+
+        job_id = enqueue_job(cursor, "bulk_ticket_email", {"ticket_ids": ticket_ids}, decoded["uid"])
+        record_slot_changes(
+            cursor, [(item["location"], item["date"], item["slot"]) for item in items], occupied=True
+        )
+
+        db.commit()
+
+    for item in items:
+        mark_slot(item["location"], item["date"], item["slot"], occupied=True)
+
+    wake_job_worker()
+
+    base_url = request.url_root.rstrip("/")
+    return jsonify({
+        "success": True,
+        "ticket_ids": ticket_ids,
+        "job_id": job_id,
+        "download_urls": [f"{base_url}/api/ticket-pdf/{ticket_id}" for ticket_id in ticket_ids]
+    }), 201
+
+
+def generate_bulk_ticket_pdf_and_send_email(ticket_ids):
+    if not ticket_ids:
+        return
+
+    placeholders = ",".join(["%s"] * len(ticket_ids))
+    with get_db() as db, db.cursor(dictionary=True) as cursor:
+        cursor.execute(
+            f"SELECT * FROM bookings WHERE id IN ({placeholders}) ORDER BY id", tuple(ticket_ids)
+        )
+        bookings = cursor.fetchall()
+
+    if not bookings:
+        return
+
+    pdf_bytes = render_tickets_pdf(bookings)
+
+    try:
+        user_email = get_user_email(bookings[0]["firebase_uid"])
+
+        rows = "".join(
+            f"<b>Ticket {b['id']}:</b> Slot {b['slot_no']} at {b['location']}<br>"
+            for b in bookings
+        )
+        send_ticket_email(
+            user_email,
+            f"Parking Booking Confirmation ({len(bookings)} slots)",
+            f"""
+Your parking bookings are confirmed.<br><br>
+{rows}
+""",
+            attachment=(f"tickets_{bookings[0]['id']}-{bookings[-1]['id']}.pdf", pdf_bytes),
+            idempotency_key=f"tickets:{bookings[0]['id']}-{bookings[-1]['id']}"
+        )
+
+    except Exception as e:
+        print("Bulk email error:", e)
+        raise  # let the job queue retry
+
+
+# =========================================================
+# HOURLY TICKET PDF (MAP QR + AUTO EMAIL)
+# =========================================================
+@app.route("/api/ticket-pdf/<int:ticket_id>", methods=["GET"])
+def ticket_pdf(ticket_id):
+
+    with get_db() as db, db.cursor(dictionary=True) as cursor:
+        cursor.execute("SELECT * FROM bookings WHERE id=%s", (ticket_id,))
+        booking = cursor.fetchone()
+
+    if not booking:
+        return jsonify({"error": "Ticket not found"}), 404
+
+    etag = ticket_etag(booking)
+    last_modified = booking.get("created_at")
+
+    # Gate attendants re-download the same ticket all day: answer 304
+    # without touching the renderer when their copy is current.
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+
+    etag, pdf_bytes = get_ticket_pdf_bytes(booking)
+
+    response = send_file(
+        BytesIO(pdf_bytes),
+        mimetype="application/pdf",
+        as_attachment=True,
+        download_name=f"ticket_{ticket_id}.pdf",
+        etag=etag,
+        last_modified=last_modified,
+        conditional=True,
+    )
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+# =========================================================
+# MONTHLY TICKET PDF (MAP QR)
+# =========================================================
+# =========================================================
+# CONFIRM MONTHLY BOOKING
+# =========================================================
+@app.route("/api/confirm-monthly-booking", methods=["POST"])
+@idempotent
+def confirm_monthly_booking():
+
+    decoded, error = verify_token()
+    if error:
+        return jsonify({"error": error[0]}), error[1]
+
+    data = request.get_json()
+
+    if not data:
+        return jsonify({"error": "No data received"}), 400
+
+    # Validate required fields
+    required_fields = [
+        "customer_name",
+        "vehicle_no",
+        "phone_no",
+        "location",
+        "package_months",
+        "amount"
+    ]
+
+    for field in required_fields:
+        if not data.get(field):
+            return jsonify({"error": f"{field} is required"}), 400
+
+    try:
+        with get_db() as db, db.cursor() as cursor:
+            # ✅ Get user email + ensure the users row exists (foreign key)
+            user_email = get_user_email(decoded["uid"], cursor)
+
+            # ✅ Calculate start and end date
+            start_date = datetime.now().date()
+            end_date = start_date + timedelta(days=int(data.get("package_months")) * 30)
+
+            # ✅ Insert monthly booking
+            db.start_transaction()
+
+            cursor.execute("""
+                INSERT INTO monthly_bookings
+                (firebase_uid, customer_name, email, phone_no, vehicle_no, location,
+                 latitude, longitude, package_months, amount,
+                 start_date, end_date, created_at)
+                VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,NOW())
+            """, (
+                decoded["uid"],
+                data.get("customer_name"),
+                user_email,
+                data.get("phone_no"),
+                data.get("vehicle_no"),
+                data.get("location"),
+                data.get("latitude"),
+                data.get("longitude"),
+                data.get("package_months"),
+                data.get("amount"),
+                start_date,
+                end_date
+            ))
+
+            monthly_id = cursor.lastrowid
+
+            add_monthly_pass_rollup(
+                cursor, data.get("location"), start_date,
+                int(data.get("package_months")), data.get("amount")
+            )
+
+            # Generate PDF + Send Email (job worker)
+            job_id = enqueue_job(
+                cursor, "monthly_ticket_email", {"monthly_id": monthly_id}, decoded["uid"]
+            )
+
+            db.commit()
+
+        wake_job_worker()
+
+        return jsonify({
+            "success": True,
+            "monthly_id": monthly_id,
+            "job_id": job_id,
+            "amount": data.get("amount")
+        }), 201
+
+    except Exception as e:
+        print("Monthly Booking Error:", e)
+        return jsonify({"error": "Internal Server Error"}), 500
+
+# =========================================================
+# GENERATE MONTHLY TICKET PDF + SEND EMAIL (MODERN SINGLE PAGE)
+# =========================================================
+def generate_monthly_ticket_pdf_and_send_email(monthly_id):
+
+    with get_db() as db, db.cursor(dictionary=True) as cursor:
+        cursor.execute("SELECT * FROM monthly_bookings WHERE id=%s", (monthly_id,))
+        booking = cursor.fetchone()
+
+    if not booking:
+        return None
+
+    pdf_bytes = get_monthly_ticket_pdf_bytes(booking)
+
+    # =========================
+    # 📧 SEND EMAIL
+    # =========================
+    try:
+        user_email = get_user_email(booking["firebase_uid"])
+
+        send_ticket_email(
+            user_email,
+            "Monthly Parking Pass Confirmation",
+            f"""
+Your monthly parking pass is confirmed.<br><br>
+<b>Ticket ID:</b> {booking['id']}<br>
+<b>Location:</b> {booking['location']}<br>
+<b>Package:</b> {booking['package_months']} Months<br>
+<b>Amount Paid:</b> ₹{booking['amount']}<br><br>
 Your Monthly Pass PDF is attached.
 """,
-            pdf_path
+            attachment=(f"monthly_ticket_{monthly_id}.pdf", pdf_bytes),
+            idempotency_key=f"monthly:{monthly_id}"
+        )
+
+    except Exception as e:
+        print("Monthly email error:", e)
+        raise  # let the job queue retry
+
+    return pdf_bytes
+
+
+MONTHLY_TICKET_LAYOUT_VERSION = "monthly-v2"
+
+
+def get_monthly_ticket_pdf_bytes(booking):
+    """Monthly pass PDF, from the artifact store when this version of it was rendered before."""
+    raw = "|".join(f"{field}={booking[field]}" for field in sorted(booking))
+    version = hashlib.sha256(f"{MONTHLY_TICKET_LAYOUT_VERSION}|{raw}".encode()).hexdigest()[:32]
+    return load_or_render(
+        "monthly_tickets", f"monthly_ticket_{booking['id']}_{version}.pdf",
+        lambda: render_monthly_ticket_pdf(booking)
+    )
+
+
+def render_monthly_ticket_pdf(booking):
+    """Render the monthly pass and return the PDF bytes (no temp files)."""
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table
+    from reportlab.lib.pagesizes import A4
+
+    map_link = f"https://www.google.com/maps?q={booking['latitude']},{booking['longitude']}"
+
+    qr_png = get_qr_png(map_link)
+
+    # =========================
+    # 📄 MODERN SINGLE PAGE PDF
+    # =========================
+    template = ticket_templates()["monthly"]
+    normal = template["normal"]
+
+    pdf_buffer = BytesIO()
+    doc = SimpleDocTemplate(
+        pdf_buffer,
+        pagesize=A4,
+        rightMargin=30,
+        leftMargin=30,
+        topMargin=30,
+        bottomMargin=30
+    )
+
+    elements = []
+
+    # ===== HEADER BAR =====
+    elements.append(Table(
+        [[static_flowable(template["header"])]],
+        colWidths=template["full_width"], style=template["header_style"]
+    ))
+    elements.append(Spacer(1, 15))
+
+    # ===== TICKET ID + STATUS =====
+    status_color = "#16a34a" if booking.get("payment_status", "Paid") == "Paid" else "#dc2626"
+
+    id_status_table = Table([[
+        Paragraph(f"<b>Ticket ID:</b> #{booking['id']}", normal),
+        Paragraph(f"<b>Status:</b> <font color='{status_color}'>PAID</font>", normal)
+    ]], colWidths=template["id_status_widths"])
+
+    elements.append(id_status_table)
+    elements.append(Spacer(1, 15))
+
+    # ===== COMPACT DETAILS GRID =====
+    data = [
+        ["Customer", booking["customer_name"], "Vehicle", booking["vehicle_no"]],
+        ["Phone", booking["phone_no"], "Location", booking["location"]],
+        ["Duration", f"{booking['package_months']} Months", "Amount", f"₹ {booking['amount']}"],
+        ["Start", str(booking["start_date"]), "End", str(booking["end_date"])],
+    ]
+
+    elements.append(Table(data, colWidths=template["details_widths"], style=template["details_style"]))
+    elements.append(Spacer(1, 20))
+
+    # ===== QR SECTION =====
+    elements.append(static_flowable(template["caption"]))
+    elements.append(Spacer(1, 10))
+
+    qr_image = template["QRImage"](qr_image_reader(qr_png), template["qr_size"])
+    elements.append(Table([[qr_image]], colWidths=template["full_width"], style=template["qr_style"]))
+    elements.append(Spacer(1, 10))
+
+    elements.append(Paragraph(
+        f'<a href="{map_link}">Open Location in Google Maps</a>',
+        template["map_link_style"]
+    ))
+
+    elements.append(Spacer(1, 20))
+
+    # ===== FOOTER =====
+    elements.append(static_flowable(template["footer"]))
+
+    # Build PDF
+    with timed("pdf_render"):
+        doc.build(elements)
+
+    return pdf_buffer.getvalue()
+
+
+# =========================================================
+# ADMIN LISTINGS (KEYSET PAGINATION + STREAMING)
+# =========================================================
+# ?limit=100&after=<next_after>  -> {"items": [...], "next_after": ...}
+# no limit/after                 -> the full JSON array, streamed in batches
+# ?fields=id,slot_no,...         -> only these columns
+ADMIN_LISTINGS = {
+    "bookings": {
+        "order": ("id",),
+        "columns": (
+            "id", "firebase_uid", "slot_no", "vehicle_no", "location",
+            "latitude", "longitude", "booking_date", "created_at",
+            "entry_time", "exit_time", "total_hours", "parking_amount", "status",
+        ),
+    },
+    "monthly_bookings": {
+        "order": ("created_at", "id"),
+        "columns": (
+            "id", "firebase_uid", "customer_name", "email", "phone_no",
+            "vehicle_no", "location", "latitude", "longitude", "package_months",
+            "amount", "start_date", "end_date", "created_at",
+        ),
+    },
+}
+ADMIN_PAGE_DEFAULT = int(os.getenv("ADMIN_PAGE_DEFAULT", "100"))
+ADMIN_PAGE_MAX = int(os.getenv("ADMIN_PAGE_MAX", "1000"))
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "500"))
+
+
+def encode_cursor(row, order):
+    raw = json.dumps([str(row[column]) for column in order])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token, order):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    except ValueError:
+        values = None
+
+    if not isinstance(values, list) or len(values) != len(order):
+        raise ValueError("bad 'after' cursor")
+    return values
+
+
+def parse_fields(table):
+    fields = request.args.get("fields")
+    if not fields:
+        return None
+
+    columns = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [c for c in columns if c not in ADMIN_LISTINGS[table]["columns"]]
+    if unknown:
+        raise ValueError(f"Unknown field(s): {', '.join(unknown)}")
+
+    # The sort key is needed to build next_after
+    for column in ADMIN_LISTINGS[table]["order"]:
+        if column not in columns:
+            columns.append(column)
+    return columns
+
+
+STREAM_MAX_CONNECTIONS = int(os.getenv("STREAM_MAX_CONNECTIONS", "4"))
+_stream_slots = threading.BoundedSemaphore(STREAM_MAX_CONNECTIONS)
+
+
+class RowStream:
+    """Iterator over batches of an executed, unbuffered query.
+
+    Iterating to the end closes it; close() before that (client gone)
+    shuts the socket down instead of closing the cursor, which would raise
+    "Unread result found" or read the rest of the table; the server then
+    aborts the query. Either way the stream slot is given back.
+    """
+
+    def __init__(self, cnx, cursor, batch_size):
+        self._cnx = cnx
+        self._cursor = cursor
+        self._batch_size = batch_size
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._cnx is None:
+            raise StopIteration
+        rows = self._cursor.fetchmany(self._batch_size)
+        if not rows:
+            self._close(finished=True)
+            raise StopIteration
+        return rows
+
+    def close(self):
+        self._close(finished=False)
+
+    def _close(self, finished):
+        cnx, self._cnx = self._cnx, None
+        if cnx is None:
+            return
+        try:
+            if finished:
+                try:
+                    self._cursor.close()
+                    cnx.close()
+                except Exception:
+                    cnx.shutdown()
+            else:
+                cnx.shutdown()
+        finally:
+            _stream_slots.release()
+
+
+def stream_rows(query, params=(), batch_size=None, dictionary=True):
+    """Run query on an unbuffered cursor; returns a RowStream of batch_size rows.
+
+    Streams run on their own connection, outside the pool, so a slow
+    download doesn't hold one of the DB_POOL_SIZE connections every other
+    request needs; at most STREAM_MAX_CONNECTIONS per process. Taking the
+    slot, connecting and executing happen here, before anything is sent,
+    so a view can still answer 503 / 500; it hands the stream's close() to
+    the response so the slot is freed even if the body is never read.
+    """
+    if not _stream_slots.acquire(timeout=db_pool_config["timeout"]):
+        raise PoolExhausted(
+            f"No free stream connection after {db_pool_config['timeout']}s (max {STREAM_MAX_CONNECTIONS})"
         )
 
-    except Exception as e:
-        print("Monthly email error:", e)
+    cnx = None
+    try:
+        with timed("db_connect"):
+            cnx = mysql.connector.connect(**db_config)
+        cursor = TimedCursor(cnx.cursor(dictionary=dictionary, buffered=False))
+        cursor.execute(query, params)
+    except BaseException:
+        if cnx is not None:
+            cnx.shutdown()
+        _stream_slots.release()
+        raise
+
+    return RowStream(cnx, cursor, batch_size or STREAM_BATCH_SIZE)
+
+
+def stream_response(stream, body, **kwargs):
+    """Response streaming body (a generator over stream); closing the
+    response closes the stream."""
+    response = app.response_class(body, **kwargs)
+    response.call_on_close(stream.close)
+    return response
+
+
+def stream_json_array(stream):
+    yield "["
+    first = True
+    for rows in stream:
+        chunk = ",".join(app.json.dumps(row) for row in rows)
+        yield chunk if first else "," + chunk
+        first = False
+    yield "]"
+
+
+def admin_listing(table):
+    listing = ADMIN_LISTINGS[table]
+    order = listing["order"]
+
+    try:
+        columns = parse_fields(table)
+        after = request.args.get("after")
+        after_values = decode_cursor(after, order) if after else None
+        limit = int(request.args["limit"]) if "limit" in request.args else None
+        if limit is not None and limit < 1:
+            raise ValueError("limit must be at least 1")
+    except (ValueError, TypeError) as e:
+        return jsonify({"error": f"Invalid query: {e}"}), 400
+
+    select = ", ".join(columns) if columns else "*"
+    order_by = ", ".join(f"{column} DESC" for column in order)
+
+    if limit is None and after_values is None:
+        query = f"SELECT {select} FROM {table} ORDER BY {order_by}"
+        try:
+            stream = stream_rows(query)
+        except PoolExhausted as e:
+            return jsonify({"error": str(e)}), 503
+        return stream_response(stream, stream_json_array(stream), mimetype="application/json")
+
+    limit = min(limit or ADMIN_PAGE_DEFAULT, ADMIN_PAGE_MAX)
+    where, params = "", []
 
-    return pdf_path
+    if after_values is not None:
+        if len(order) == 1:
+            where = f"WHERE {order[0]} < %s"
+            params = after_values
+        else:
+            # (created_at, id) < (%s, %s), written so MySQL can use the index
+            where = f"WHERE {order[0]} < %s OR ({order[0]} = %s AND {order[1]} < %s)"
+            params = [after_values[0], after_values[0], after_values[1]]
+
+    query = f"SELECT {select} FROM {table} {where} ORDER BY {order_by} LIMIT %s"
+
+    with get_db() as db, db.cursor(dictionary=True) as cursor:
+        cursor.execute(query, (*params, limit + 1))
+        rows = cursor.fetchall()
+
+    next_after = encode_cursor(rows[limit - 1], order) if len(rows) > limit else None
+
+    return jsonify({"items": rows[:limit], "next_after": next_after}), 200
 
 
 # =========================================================
-# ADMIN APIs (UNCHANGED)
+# ADMIN APIs
 # =========================================================
 @app.route("/api/admin/bookings", methods=["GET"])
 def admin_get_bookings():
@@ -598,26 +2556,510 @@ def admin_get_bookings():
     if error:
         return jsonify({"error": error[0]}), error[1]
 
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM bookings ORDER BY id DESC")
-    data = cursor.fetchall()
-    cursor.close()
-    db.close()
-    return jsonify(data)
+    return admin_listing("bookings")
 
 
 @app.route("/api/admin/monthly-bookings", methods=["GET"])
 def admin_monthly():
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM monthly_bookings ORDER BY created_at DESC")
-    data = cursor.fetchall()
-    cursor.close()
-    db.close()
-    return jsonify(data)
-
-#-------------------------------------------------------#
+    return admin_listing("monthly_bookings")
+
+
+# ---------------- CSV / NDJSON EXPORT ----------------
+# GET /api/admin/export?table=bookings&format=csv|ndjson&since=<watermark>
+#
+# For the accounting sync: rows in id order, streamed from an unbuffered
+# cursor STREAM_BATCH_SIZE at a time. `since` is the last id already
+# exported (or a YYYY-MM-DD[ HH:MM:SS] created_at lower bound); the
+# response's X-Export-Watermark header is the id to pass next time. The
+# export stops at the highest id seen when it started, so rows inserted
+# while it streams come with the next run instead of shifting the
+# watermark. Dates and datetimes are ISO 8601 in both formats, decimals
+# are kept exact (strings in NDJSON).
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+}
+
+
+def export_value(value):
+    # Same text as str() gives in the CSV: 2025-01-31 09:30:00 / 2025-01-31
+    if isinstance(value, datetime):
+        return value.isoformat(" ")
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    if isinstance(value, (Decimal, timedelta)):
+        return str(value)
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode("utf-8", "replace")
+    raise TypeError(f"Cannot export {type(value).__name__}")
+
+
+# The C encoder only calls export_value for the types it doesn't know
+ndjson_encode = json.JSONEncoder(
+    ensure_ascii=False, separators=(",", ":"), default=export_value
+).encode
+
+
+def parse_export_since(value):
+    """-> (SQL condition, param) for ?since=, or (None, None)."""
+    if not value:
+        return None, None
+    if value.isdigit():
+        return "id > %s", int(value)
+    return "created_at >= %s", datetime.fromisoformat(value)
+
+
+def stream_export(stream, columns, fmt):
+    if fmt == "csv":
+        buffer = StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        for rows in stream:
+            writer.writerows(rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+    else:
+        for rows in stream:
+            yield "".join(ndjson_encode(dict(zip(columns, row))) + "\n" for row in rows)
+
+
+@app.route("/api/admin/export", methods=["GET"])
+def admin_export():
+    decoded, error = verify_admin()
+    if error:
+        return jsonify({"error": error[0]}), error[1]
+
+    table = request.args.get("table")
+    fmt = request.args.get("format", "csv")
+
+    if table not in ADMIN_LISTINGS:
+        return jsonify({"error": f"table must be one of {', '.join(ADMIN_LISTINGS)}"}), 400
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"error": f"format must be one of {', '.join(EXPORT_FORMATS)}"}), 400
+
+    try:
+        columns = parse_fields(table) or list(ADMIN_LISTINGS[table]["columns"])
+        since_where, since_param = parse_export_since(request.args.get("since"))
+    except ValueError as e:
+        return jsonify({"error": f"Invalid query: {e}"}), 400
+
+    with get_db() as db, db.cursor() as cursor:
+        cursor.execute(f"SELECT MAX(id) FROM {table}")
+        max_id = cursor.fetchone()[0] or 0
+
+    where, params = ["id <= %s"], [max_id]
+    if since_where:
+        where.append(since_where)
+        params.append(since_param)
+
+    query = f"SELECT {', '.join(columns)} FROM {table} WHERE {' AND '.join(where)} ORDER BY id"
+
+    # Nothing new: hand the caller's id watermark back unchanged
+    watermark = max(max_id, since_param) if since_where == "id > %s" else max_id
+
+    try:
+        stream = stream_rows(query, params, dictionary=False)
+    except PoolExhausted as e:
+        return jsonify({"error": str(e)}), 503
+
+    mimetype, extension = EXPORT_FORMATS[fmt]
+    response = stream_response(stream, stream_export(stream, columns, fmt), mimetype=mimetype)
+    response.headers["Content-Disposition"] = f'attachment; filename="{table}.{extension}"'
+    response.headers["X-Export-Watermark"] = str(watermark)
+    return response
+
+
+# =========================================================
+# TICKET EXPORT (ZIP)
+# =========================================================
+# GET /api/admin/export-tickets?kind=hourly&date=2025-01-31&location=Airport
+# GET /api/admin/export-tickets?kind=monthly[&location=...]   active passes
+#
+# The PDFs are rendered on a process pool and written into the ZIP as they
+# finish; the archive is streamed out entry by entry and never held in
+# memory. Entries are stored, not deflated: the PDFs hardly compress and
+# the CPU is better spent rendering. Spawned workers import this module but
+# open no DB connections; rendered PDFs still go through the artifact store.
+#
+# The pool (EXPORT_WORKERS processes) is spawned by the first export and
+# shut down once no export has used it for EXPORT_POOL_IDLE_SECONDS. Each
+# web worker has its own, so up to WEB_CONCURRENCY x EXPORT_WORKERS
+# renderers run on a host at once.
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", str(min(4, os.cpu_count() or 1))))
+EXPORT_POOL_IDLE_SECONDS = float(os.getenv("EXPORT_POOL_IDLE_SECONDS", "60"))
+EXPORT_MAX_TICKETS = int(os.getenv("EXPORT_MAX_TICKETS", "5000"))
+EXPORT_CHUNK_SIZE = 8  # tickets per pool task
+EXPORT_POOL_RESTARTS = 1  # per export, after a pool process died
+
+# Runs in each pool process before its first task, i.e. before that
+# process imports this module; bench.py sets it to install its stand-ins.
+export_pool_initializer = None
+
+_export_pool = {"pool": None, "pid": None, "last_used": 0.0}
+_export_pool_lock = threading.Lock()
+_export_running = threading.Semaphore(1)  # one export at a time per process
+
+
+def get_export_pool():
+    if _export_pool["pid"] == os.getpid():
+        return _export_pool["pool"]
+
+    with _export_pool_lock:
+        if _export_pool["pid"] != os.getpid():
+            # spawn, not fork: forking a threaded gunicorn worker can copy held locks
+            _export_pool["pool"] = ProcessPoolExecutor(
+                max_workers=EXPORT_WORKERS, mp_context=multiprocessing.get_context("spawn"),
+                initializer=export_pool_initializer,
+            )
+            _export_pool["pid"] = os.getpid()
+
+    return _export_pool["pool"]
+
+
+def export_finished():
+    """call_on_close of an export: let the next one in, and shut the pool
+    down if nothing has used it EXPORT_POOL_IDLE_SECONDS from now."""
+    with _export_pool_lock:
+        _export_pool["last_used"] = time.monotonic()
+    _export_running.release()
+
+    timer = threading.Timer(EXPORT_POOL_IDLE_SECONDS, shut_down_idle_export_pool)
+    timer.daemon = True
+    timer.start()
+
+
+def shut_down_idle_export_pool():
+    if not _export_running.acquire(blocking=False):
+        return  # an export is running; its export_finished() re-arms this
+
+    try:
+        with _export_pool_lock:
+            idle = time.monotonic() - _export_pool["last_used"]
+            if _export_pool["pid"] != os.getpid() or idle < EXPORT_POOL_IDLE_SECONDS:
+                return
+            pool = _export_pool["pool"]
+            _export_pool["pool"] = _export_pool["pid"] = None
+    finally:
+        _export_running.release()
+
+    pool.shutdown()
+
+
+def reset_export_pool(pool):
+    """Drop a broken pool; the next get_export_pool() spawns a new one."""
+    with _export_pool_lock:
+        if _export_pool["pool"] is pool:
+            _export_pool["pid"] = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def export_file_name(kind, booking):
+    prefix = "monthly_ticket" if kind == "monthly" else "ticket"
+    return f"{prefix}_{booking['id']}.pdf"
+
+
+def render_export_tickets(kind, bookings):
+    """Pool task: [(file name, PDF bytes or None, error or None)] for a chunk of bookings."""
+    results = []
+    for booking in bookings:
+        try:
+            if kind == "monthly":
+                pdf_bytes = get_monthly_ticket_pdf_bytes(booking)
+            else:
+                pdf_bytes = get_ticket_pdf_bytes(booking)[1]
+            results.append((export_file_name(kind, booking), pdf_bytes, None))
+        except Exception as e:
+            results.append((export_file_name(kind, booking), None, repr(e)))
+    return results
+
+
+def export_ticket_pdfs(kind, bookings):
+    """Yield (name, pdf_bytes, error) in completion order, keeping at most
+    two chunks per pool process in flight.
+
+    If a pool process dies, the chunks it took down are reported as errors,
+    the pool is replaced (EXPORT_POOL_RESTARTS times per export) and the
+    export carries on; after that the remaining tickets are reported too.
+    """
+    window = 2 * EXPORT_WORKERS
+    chunks = (bookings[i:i + EXPORT_CHUNK_SIZE] for i in range(0, len(bookings), EXPORT_CHUNK_SIZE))
+    pool = get_export_pool()
+    restarts = 0
+    pending = {}  # future -> (pool, chunk)
+
+    def failed(chunk, error):
+        return [(export_file_name(kind, booking), None, error) for booking in chunk]
+
+    try:
+        while True:
+            # Top up the window; with no pool left, report the rest as failed
+            while len(pending) < window:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                if pool is None:
+                    yield from failed(chunk, "export pool unavailable")
+                    continue
+                try:
+                    pending[pool.submit(render_export_tickets, kind, chunk)] = (pool, chunk)
+                except BrokenProcessPool as e:
+                    yield from failed(chunk, repr(e))
+
+            if not pending:
+                break
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                chunk_pool, chunk = pending.pop(future)
+                try:
+                    results = future.result()
+                except Exception as e:
+                    results = failed(chunk, repr(e))
+                    if isinstance(e, BrokenProcessPool) and chunk_pool is pool:
+                        print("Export pool broke:", e)
+                        reset_export_pool(pool)
+                        pool = get_export_pool() if restarts < EXPORT_POOL_RESTARTS else None
+                        restarts += 1
+                yield from results
+    finally:
+        for future in pending:
+            future.cancel()  # client went away
+
+
+class ZipChunks:
+    """Write-only, unseekable file object for ZipFile; zipfile then writes
+    sizes after each entry (data descriptors) instead of seeking back."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_ticket_zip(kind, bookings):
+    out = ZipChunks()
+    errors = []
+    with zipfile.ZipFile(out, "w", compression=zipfile.ZIP_STORED) as zf:
+        for name, pdf_bytes, error in export_ticket_pdfs(kind, bookings):
+            if error:
+                errors.append(f"{name}: {error}")
+                continue
+            zf.writestr(name, pdf_bytes)
+            yield out.drain()
+
+        if errors:
+            zf.writestr("errors.txt", "\n".join(errors) + "\n")
+    yield out.drain()
+
+
+def export_bookings(kind, location, date):
+    if kind == "monthly":
+        query = "SELECT * FROM monthly_bookings WHERE end_date >= CURDATE()"
+        params = []
+    else:
+        query = "SELECT * FROM bookings WHERE booking_date = %s"
+        params = [date]
+
+    if location:
+        query += " AND location = %s"
+        params.append(location)
+
+    with get_db() as db, db.cursor(dictionary=True) as cursor:
+        cursor.execute(f"{query} ORDER BY id LIMIT %s", (*params, EXPORT_MAX_TICKETS + 1))
+        return cursor.fetchall()
+
+
+@app.route("/api/admin/export-tickets", methods=["GET"])
+def admin_export_tickets():
+    decoded, error = verify_admin()
+    if error:
+        return jsonify({"error": error[0]}), error[1]
+
+    kind = request.args.get("kind", "hourly")
+    location = request.args.get("location")
+    date = request.args.get("date")
+
+    if kind not in ("hourly", "monthly"):
+        return jsonify({"error": "kind must be 'hourly' or 'monthly'"}), 400
+    if kind == "hourly":
+        try:
+            date = parse_report_date(date, None)
+        except ValueError:
+            return jsonify({"error": "date must be YYYY-MM-DD"}), 400
+        if date is None:
+            return jsonify({"error": "date is required for hourly tickets"}), 400
+
+    bookings = export_bookings(kind, location, date)
+
+    if len(bookings) > EXPORT_MAX_TICKETS:
+        return jsonify({"error": f"More than {EXPORT_MAX_TICKETS} tickets, narrow the export"}), 400
+
+    if not _export_running.acquire(blocking=False):
+        response = jsonify({"error": "Another export is running, retry shortly"})
+        response.headers["Retry-After"] = "10"
+        return response, 429
+
+    parts = [kind, location, str(date) if date else None]
+    filename = "_".join(part.replace(" ", "-") for part in parts if part) + ".zip"
+
+    response = app.response_class(stream_ticket_zip(kind, bookings), mimetype="application/zip")
+    response.headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    response.headers["X-Ticket-Count"] = str(len(bookings))
+    # Runs when the stream ends or the client disconnects
+    response.call_on_close(export_finished)
+    return response
+
+# =========================================================
+# 💰 TARIFFS
+# =========================================================
+# Per-location tariffs from TARIFFS_JSON, e.g.
+#   {"default": {"rate": 50},
+#    "Airport": {"rate": 80, "bands": [{"from": 22, "to": 6, "rate": 40}],
+#                "daily_cap": 800, "grace_minutes": 10}}
+# Every started hour is billed (minimum 1) at the rate of the hour of day
+# it starts in; each 24 hours from entry costs at most daily_cap; a stay of
+# at most grace_minutes is free. Without TARIFFS_JSON every location pays
+# RATE_PER_HOUR per started hour.
+RATE_PER_HOUR = 50
+HOUR_MICROS = 3600 * 1000000
+
+
+class Tariff:
+    def __init__(self, rate=RATE_PER_HOUR, bands=(), daily_cap=None, grace_minutes=0):
+        rates = [rate] * 24
+        for band in bands:
+            hour, end = int(band["from"]) % 24, int(band["to"]) % 24
+            while True:  # from == to covers the whole day
+                rates[hour] = band["rate"]
+                hour = (hour + 1) % 24
+                if hour == end:
+                    break
+
+        self.rates = rates
+        # cum[k] = sum of the rates of hours [0, k) over two days, so any 24h
+        # window starting at hour s is cum[s + n] - cum[s]
+        self.cum = list(itertools.accumulate(rates * 2, initial=0))
+        self.daily_cap = daily_cap
+        self.grace_micros = int(grace_minutes * 60 * 1000000)
+
+    def window(self, start_hour, hours):
+        """Price of `hours` (< 24) consecutive hours from start_hour, capped."""
+        amount = self.cum[start_hour + hours] - self.cum[start_hour]
+        return amount if self.daily_cap is None else min(amount, self.daily_cap)
+
+    def charge(self, entry_time, exit_time):
+        """(total_hours, amount) for one stay."""
+        delta = exit_time - entry_time
+        micros = (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+        hours = max(1, -(-micros // HOUR_MICROS))
+
+        if self.grace_micros and micros <= self.grace_micros:
+            return hours, 0
+
+        days, rest = divmod(hours, 24)
+        return hours, days * self.window(0, 24) + self.window(entry_time.hour, rest)
+
+
+def load_tariffs(raw):
+    config = json.loads(raw) if raw else {}
+    config.setdefault("default", {"rate": RATE_PER_HOUR})
+    return {location: Tariff(**options) for location, options in config.items()}
+
+
+TARIFFS = load_tariffs(os.getenv("TARIFFS_JSON"))
+
+
+def tariff_for(location, tariffs=None):
+    tariffs = tariffs or TARIFFS
+    return tariffs.get(location) or tariffs["default"]
+
+
+def compute_parking_charge(entry_time, exit_time, location=None):
+    """(total_hours, amount) under the tariff of `location`."""
+    return tariff_for(location).charge(entry_time, exit_time)
+
+
+def reprice(entry_times, exit_times, locations, tariffs=None):
+    """Tariff.charge over whole columns at once (numpy), for what-if runs.
+
+    Returns (hours, amounts) arrays; amounts are float64.
+    """
+    import numpy as np
+
+    tariffs = tariffs or TARIFFS
+    entry = np.asarray(entry_times, dtype="datetime64[us]")
+    micros = (np.asarray(exit_times, dtype="datetime64[us]") - entry).astype(np.int64)
+    hours = np.maximum(1, -(-micros // HOUR_MICROS))
+    start_hour = entry.astype("datetime64[h]").astype(np.int64) % 24
+
+    names, tariff_ids = np.unique(np.asarray(locations, dtype=str), return_inverse=True)
+    table = [tariff_for(name, tariffs) for name in names]
+    cum = np.array([t.cum for t in table], dtype=np.float64)
+    cap = np.array([np.inf if t.daily_cap is None else t.daily_cap for t in table])
+    grace = np.array([t.grace_micros for t in table], dtype=np.int64)
+
+    days, rest = np.divmod(hours, 24)
+    full_day = np.minimum(cum[:, 24], cap)
+    window = cum[tariff_ids, start_hour + rest] - cum[tariff_ids, start_hour]
+    amounts = days * full_day[tariff_ids] + np.minimum(window, cap[tariff_ids])
+    free = micros <= grace[tariff_ids]
+    amounts[free & (grace[tariff_ids] > 0)] = 0
+
+    return hours, amounts
+
+
+@app.cli.command("reprice-bookings")
+@click.option("--since", required=True, help="Checked out on/after this date (YYYY-MM-DD)")
+@click.option("--until", help="Checked out before this date (default: now)")
+@click.option("--tariffs", "tariffs_json", help="Tariff JSON to price with (default: TARIFFS_JSON)")
+def reprice_bookings_command(since, until, tariffs_json):
+    """What-if: re-price closed bookings under a tariff; nothing is written."""
+    tariffs = load_tariffs(tariffs_json) if tariffs_json else TARIFFS
+    entries, exits, locations, charged = [], [], [], []
+
+    start = time.perf_counter()
+    for rows in stream_rows("""
+        SELECT location, entry_time, exit_time, parking_amount
+        FROM bookings
+        WHERE exit_time IS NOT NULL AND exit_time >= %s AND exit_time < %s
+    """, (since, until or datetime.now())):
+        for row in rows:
+            locations.append(row["location"] or "")
+            entries.append(row["entry_time"])
+            exits.append(row["exit_time"])
+            charged.append(float(row["parking_amount"] or 0))
+    loaded = time.perf_counter()
+
+    if not entries:
+        print("No closed bookings in range")
+        return
+
+    _, amounts = reprice(entries, exits, locations, tariffs)
+    priced = time.perf_counter()
+
+    totals = {}
+    for location, old, new in zip(locations, charged, amounts.tolist()):
+        count, old_total, new_total = totals.get(location, (0, 0.0, 0.0))
+        totals[location] = (count + 1, old_total + old, new_total + new)
+
+    print(f"{len(entries)} booking(s): loaded in {loaded - start:.2f}s, priced in {priced - loaded:.3f}s")
+    for location, (count, old_total, new_total) in sorted(totals.items()):
+        print(f"  {location or '-'}: {count} bookings, ₹ {old_total:,.2f} -> ₹ {new_total:,.2f} "
+              f"({new_total - old_total:+,.2f})")
+
+
 @app.route("/api/admin/revoke-booking", methods=["POST"])
 def admin_revoke_booking():
     decoded, error = verify_token()
@@ -630,58 +3072,49 @@ def admin_revoke_booking():
     if not booking_id:
         return jsonify({"error": "Booking ID required"}), 400
 
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
-
-    # 🔹 Fetch active booking
-    cursor.execute("""
-        SELECT entry_time
-        FROM bookings
-        WHERE id = %s AND exit_time IS NULL
-    """, (booking_id,))
-    booking = cursor.fetchone()
+    with get_db() as db, db.cursor(dictionary=True) as cursor:
+        db.start_transaction()
 
-    if not booking:
-        cursor.close()
-        db.close()
-        return jsonify({"error": "Active booking not found"}), 404
+        # 🔹 Fetch active booking (locked so two revokes can't both close it)
+        cursor.execute("""
+            SELECT entry_time, location, booking_date, slot_no
+            FROM bookings
+            WHERE id = %s AND exit_time IS NULL
+            FOR UPDATE
+        """, (booking_id,))
+        booking = cursor.fetchone()
 
-    entry_time = booking["entry_time"]
-    exit_time = datetime.now()
+        if not booking:
+            return jsonify({"error": "Active booking not found"}), 404
 
-    # ⏱️ Duration calculation
-    duration_seconds = (exit_time - entry_time).total_seconds()
-    total_hours = int(duration_seconds // 3600)
+        entry_time = booking["entry_time"]
+        exit_time = datetime.now()
 
-    # round up
-    if duration_seconds % 3600 != 0:
-        total_hours += 1
+        total_hours, parking_amount = compute_parking_charge(entry_time, exit_time, booking["location"])
 
-    if total_hours == 0:
-        total_hours = 1
+        # 🔁 Update booking
+        cursor.execute("""
+            UPDATE bookings
+            SET exit_time = %s,
+                total_hours = %s,
+                parking_amount = %s,
+                status = 'revoked'
+            WHERE id = %s
+        """, (
+            exit_time,
+            total_hours,
+            parking_amount,
+            booking_id
+        ))
 
-    # 💰 Pricing (change later if needed)
-    RATE_PER_HOUR = 50
-    parking_amount = total_hours * RATE_PER_HOUR
+        record_slot_change(
+            cursor, booking["location"], booking["booking_date"], booking["slot_no"], occupied=False
+        )
+        add_booking_rollups(cursor, [(booking["location"], exit_time, total_hours, parking_amount)])
 
-    # 🔁 Update booking
-    cursor.execute("""
-        UPDATE bookings
-        SET exit_time = %s,
-            total_hours = %s,
-            parking_amount = %s,
-            status = 'revoked'
-        WHERE id = %s
-    """, (
-        exit_time,
-        total_hours,
-        parking_amount,
-        booking_id
-    ))
+        db.commit()
 
-    db.commit()
-    cursor.close()
-    db.close()
+    mark_slot(booking["location"], booking["booking_date"], booking["slot_no"], occupied=False)
 
     return jsonify({
         "success": True,
@@ -693,64 +3126,984 @@ def admin_revoke_booking():
     }), 200
 
 
-def send_ticket_email(to_email, subject, body, attachment_path=None):
-    if not brevo_api:
-        print("⚠ Email skipped (Brevo not configured)")
+# =========================================================
+# BULK CHECKOUT + END-OF-DAY SETTLEMENT
+# =========================================================
+# Closes many bookings in one transaction: the matching rows are locked,
+# priced with the same tariffs as admin_revoke_booking and written by a
+# single CASE UPDATE, and their slot events and rollups written before the
+# commit.
+CHECKOUT_BATCH_MAX = int(os.getenv("CHECKOUT_BATCH_MAX", "1000"))
+
+
+def checkout_filter(booking_ids=None, location=None, before=None):
+    clauses, params = ["exit_time IS NULL"], []
+
+    if booking_ids:
+        clauses.append(f"id IN ({', '.join(['%s'] * len(booking_ids))})")
+        params.extend(booking_ids)
+    if location:
+        clauses.append("location = %s")
+        params.append(location)
+    if before:
+        clauses.append("entry_time < %s")
+        params.append(before)
+
+    return " AND ".join(clauses), params
+
+
+def checkout_bookings(where, params, exit_time, limit=None):
+    """Close up to `limit` open bookings matching `where`; returns their summaries."""
+    limit = limit or CHECKOUT_BATCH_MAX
+
+    with get_db() as db, db.cursor(dictionary=True) as cursor:
+        db.start_transaction()
+
+        cursor.execute(f"""
+            SELECT id, entry_time, location, booking_date, slot_no
+            FROM bookings
+            WHERE {where}
+            ORDER BY id
+            LIMIT %s
+            FOR UPDATE
+        """, (*params, limit))
+        bookings = cursor.fetchall()
+
+        if not bookings:
+            db.rollback()
+            return []
+
+        charges = {
+            b["id"]: compute_parking_charge(b["entry_time"], exit_time, b["location"])
+            for b in bookings
+        }
+        ids = list(charges)
+        when = " ".join(["WHEN %s THEN %s"] * len(ids))
+
+        cursor.execute(f"""
+            UPDATE bookings
+            SET exit_time = %s,
+                total_hours = CASE id {when} END,
+                parking_amount = CASE id {when} END,
+                status = 'revoked'
+            WHERE id IN ({", ".join(["%s"] * len(ids))})
+        """, (
+            exit_time,
+            *itertools.chain.from_iterable((i, charges[i][0]) for i in ids),
+            *itertools.chain.from_iterable((i, charges[i][1]) for i in ids),
+            *ids
+        ))
+
+        record_slot_changes(
+            cursor, [(b["location"], b["booking_date"], b["slot_no"]) for b in bookings], occupied=False
+        )
+        add_booking_rollups(cursor, [
+            (b["location"], exit_time, *charges[b["id"]]) for b in bookings
+        ])
+
+        db.commit()
+
+    for b in bookings:
+        mark_slot(b["location"], b["booking_date"], b["slot_no"], occupied=False)
+
+    return [
+        {
+            "booking_id": b["id"],
+            "location": b["location"],
+            "slot_no": b["slot_no"],
+            "entry_time": b["entry_time"],
+            "exit_time": exit_time,
+            "total_hours": charges[b["id"]][0],
+            "amount": charges[b["id"]][1]
+        }
+        for b in bookings
+    ]
+
+
+@app.route("/api/admin/checkout-bookings", methods=["POST"])
+def admin_checkout_bookings():
+    decoded, error = verify_admin()
+    if error:
+        return jsonify({"error": error[0]}), error[1]
+
+    data = request.get_json() or {}
+    booking_ids = data.get("booking_ids")
+    location = data.get("location")
+    before = data.get("before")
+
+    if not (booking_ids or location or before):
+        return jsonify({"error": "booking_ids, location or before required"}), 400
+
+    try:
+        if booking_ids is not None:
+            booking_ids = [int(b) for b in booking_ids]
+            if len(booking_ids) > CHECKOUT_BATCH_MAX:
+                return jsonify({"error": f"At most {CHECKOUT_BATCH_MAX} booking_ids per request"}), 400
+        if before:
+            before = datetime.fromisoformat(before)
+    except (TypeError, ValueError):
+        return jsonify({"error": "booking_ids must be integers, before an ISO datetime"}), 400
+
+    where, params = checkout_filter(booking_ids, location, before)
+    closed = checkout_bookings(where, params, datetime.now())
+
+    # One batch per request: has_more tells the caller to send it again
+    has_more = False
+    if len(closed) == CHECKOUT_BATCH_MAX:
+        with get_db() as db, db.cursor() as cursor:
+            cursor.execute(f"SELECT 1 FROM bookings WHERE {where} LIMIT 1", params)
+            has_more = cursor.fetchone() is not None
+
+    return jsonify({
+        "success": True,
+        "count": len(closed),
+        "has_more": has_more,
+        "total_hours": sum(c["total_hours"] for c in closed),
+        "amount": sum(c["amount"] for c in closed),
+        "bookings": closed
+    }), 200
+
+
+@app.cli.command("settle-bookings")
+@click.option("--before", help="Only bookings that started before this ISO datetime (default: now)")
+@click.option("--location", help="Only this location")
+def settle_bookings_command(before, location):
+    """End-of-day settlement: check out every booking still open."""
+    exit_time = datetime.now()
+    where, params = checkout_filter(
+        location=location, before=datetime.fromisoformat(before) if before else exit_time
+    )
+
+    count, hours, amount = 0, 0, 0
+    while True:
+        closed = checkout_bookings(where, params, exit_time)
+        if not closed:
+            break
+        count += len(closed)
+        hours += sum(c["total_hours"] for c in closed)
+        amount += sum(c["amount"] for c in closed)
+
+    print(f"Settled {count} booking(s): {hours} hour(s), ₹ {amount}")
+
+
+# =========================================================
+# REVENUE ROLLUPS + REPORTS
+# =========================================================
+# booking_rollups / monthly_pass_rollups (migrations/004_rollups.sql) are
+# bumped in the same transaction as each checkout and monthly pass sale,
+# so /api/admin/reports reads a few hundred rows instead of the history.
+REPORT_MAX_DAYS = int(os.getenv("REPORT_MAX_DAYS", "400"))
+
+
+def add_booking_rollups(cursor, checkouts):
+    """checkouts: [(location, exit_time, total_hours, amount), ...]"""
+    buckets = {}
+    for location, exit_time, total_hours, amount in checkouts:
+        key = (exit_time.date(), location, exit_time.hour)
+        count, hours, revenue = buckets.get(key, (0, 0, 0))
+        buckets[key] = (count + 1, hours + total_hours, revenue + amount)
+
+    if not buckets:
         return
 
+    cursor.executemany("""
+        INSERT INTO booking_rollups (day, location, hour, bookings, hours, revenue)
+        VALUES (%s, %s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            bookings = bookings + VALUES(bookings),
+            hours = hours + VALUES(hours),
+            revenue = revenue + VALUES(revenue)
+    """, [(*key, *totals) for key, totals in sorted(buckets.items())])
+
+
+def add_monthly_pass_rollup(cursor, location, start_date, package_months, amount):
+    cursor.execute("""
+        INSERT INTO monthly_pass_rollups (month, location, passes, months, revenue)
+        VALUES (%s, %s, 1, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            passes = passes + 1,
+            months = months + VALUES(months),
+            revenue = revenue + VALUES(revenue)
+    """, (start_date.replace(day=1), location, package_months, amount))
+
+
+@app.cli.command("rebuild-rollups")
+def rebuild_rollups_command():
+    """Recompute both rollup tables from bookings / monthly_bookings."""
+    with get_db() as db, db.cursor() as cursor:
+        db.start_transaction()
+
+        cursor.execute("DELETE FROM booking_rollups")
+        cursor.execute("""
+            INSERT INTO booking_rollups (day, location, hour, bookings, hours, revenue)
+            SELECT DATE(exit_time), location, HOUR(exit_time),
+                   COUNT(*), COALESCE(SUM(total_hours), 0), COALESCE(SUM(parking_amount), 0)
+            FROM bookings
+            WHERE exit_time IS NOT NULL
+            GROUP BY DATE(exit_time), location, HOUR(exit_time)
+        """)
+        booking_rows = cursor.rowcount
+
+        cursor.execute("DELETE FROM monthly_pass_rollups")
+        cursor.execute("""
+            INSERT INTO monthly_pass_rollups (month, location, passes, months, revenue)
+            SELECT DATE_FORMAT(start_date, '%Y-%m-01'), location,
+                   COUNT(*), COALESCE(SUM(package_months), 0), COALESCE(SUM(amount), 0)
+            FROM monthly_bookings
+            GROUP BY DATE_FORMAT(start_date, '%Y-%m-01'), location
+        """)
+        pass_rows = cursor.rowcount
+
+        db.commit()
+
+    print(f"Rebuilt {booking_rows} booking rollup row(s), {pass_rows} monthly pass rollup row(s)")
+
+
+def parse_report_date(value, default):
+    if not value:
+        return default
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+@app.route("/api/admin/reports", methods=["GET"])
+def admin_reports():
+    decoded, error = verify_admin()
+    if error:
+        return jsonify({"error": error[0]}), error[1]
+
+    group = request.args.get("group", "day")
+    location = request.args.get("location")
+
     try:
-        sender = {
-            "name": "ParksMart",
-            "email": "dmnprksmrt@gmail.com"
-        }
+        end = parse_report_date(request.args.get("to"), datetime.now().date())
+        start = parse_report_date(request.args.get("from"), end - timedelta(days=29))
+    except ValueError:
+        return jsonify({"error": "from/to must be YYYY-MM-DD"}), 400
+
+    if group not in ("day", "hour"):
+        return jsonify({"error": "group must be 'day' or 'hour'"}), 400
+    if start > end or (end - start).days >= REPORT_MAX_DAYS:
+        return jsonify({"error": f"from..to must be a range of at most {REPORT_MAX_DAYS} days"}), 400
+
+    where, params = "WHERE day BETWEEN %s AND %s", [start, end]
+    if location:
+        where += " AND location = %s"
+        params.append(location)
+
+    if group == "hour":
+        parking_query = f"""
+            SELECT day, location, hour, bookings, hours, revenue
+            FROM booking_rollups {where}
+            ORDER BY day, location, hour
+        """
+    else:
+        parking_query = f"""
+            SELECT day, location, SUM(bookings) AS bookings, SUM(hours) AS hours,
+                   SUM(revenue) AS revenue
+            FROM booking_rollups {where}
+            GROUP BY day, location
+            ORDER BY day, location
+        """
+
+    pass_where = where.replace("day BETWEEN", "month BETWEEN")
+    pass_params = [start.replace(day=1), end.replace(day=1)] + params[2:]
+
+    with get_db() as db, db.cursor(dictionary=True) as cursor:
+        cursor.execute(parking_query, params)
+        parking = cursor.fetchall()
+
+        cursor.execute(f"""
+            SELECT month, location, passes, months, revenue
+            FROM monthly_pass_rollups {pass_where}
+            ORDER BY month, location
+        """, pass_params)
+        passes = cursor.fetchall()
+
+    # SUM() comes back as Decimal, which jsonify would turn into strings
+    for row in parking:
+        row["day"] = str(row["day"])
+        row["bookings"] = int(row["bookings"] or 0)
+        row["hours"] = int(row["hours"] or 0)
+        row["revenue"] = float(row["revenue"] or 0)
+    for row in passes:
+        row["month"] = str(row["month"])[:7]
+        row["passes"] = int(row["passes"] or 0)
+        row["months"] = int(row["months"] or 0)
+        row["revenue"] = float(row["revenue"] or 0)
 
-        to = [{"email": to_email}]
-        attachments = []
+    return jsonify({
+        "from": str(start),
+        "to": str(end),
+        "group": group,
+        "parking": parking,
+        "monthly_passes": passes,
+        "totals": {
+            "bookings": sum(row["bookings"] for row in parking),
+            "hours": sum(row["hours"] for row in parking),
+            "parking_revenue": sum(row["revenue"] for row in parking),
+            "passes": sum(row["passes"] for row in passes),
+            "pass_revenue": sum(row["revenue"] for row in passes),
+        }
+    }), 200
 
-        if attachment_path:
-            with open(attachment_path, "rb") as f:
-                encoded_file = base64.b64encode(f.read()).decode()
 
-            attachments.append({
-                "content": encoded_file,
-                "name": os.path.basename(attachment_path)
-            })
+# =========================================================
+# OUTBOUND MAIL (RATE LIMITED + COALESCED)
+# =========================================================
+# All Brevo sends go through one sender thread per process:
+#  - a token bucket keeps us under the Brevo quota (MAIL_RATE_PER_SECOND)
+#  - messages queued within MAIL_COALESCE_SECONDS for the same recipient
+#    are merged into one email with all attachments
+#  - 429 / 5xx / connection errors are retried with backoff; every send
+#    carries an idempotencyKey header so a retry is never delivered twice
+MAIL_RATE_PER_SECOND = float(os.getenv("MAIL_RATE_PER_SECOND", "5"))
+MAIL_BURST = int(os.getenv("MAIL_BURST", "10"))
+MAIL_COALESCE_SECONDS = float(os.getenv("MAIL_COALESCE_SECONDS", "0.25"))
+MAIL_MAX_RETRIES = int(os.getenv("MAIL_MAX_RETRIES", "3"))
+MAIL_SEND_TIMEOUT = float(os.getenv("MAIL_SEND_TIMEOUT", "120"))
+MAIL_HTTP_TIMEOUT = float(os.getenv("MAIL_HTTP_TIMEOUT", "15"))  # per Brevo HTTP call
+MAIL_SENDER = {"name": "ParksMart", "email": "dmnprksmrt@gmail.com"}
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+
+class Mailer:
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.bucket = TokenBucket(MAIL_RATE_PER_SECOND, MAIL_BURST)
+        self.sent_keys = LRUCache(8192)
+        self._pid = None
+        self._lock = threading.Lock()
+
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.batches = 0
+        self.coalesced = 0
+        self.duplicates = 0
+        self._send_calls = 0
+        self._send_seconds = 0.0
+        self._send_max = 0.0
+
+    def submit(self, to_email, subject, body, attachments, key):
+        future = Future()
+
+        if self.sent_keys.get(key):
+            with self._lock:
+                self.duplicates += 1
+            future.set_result("duplicate")
+            return future
+
+        self._ensure_thread()
+        self.queue.put({
+            "to": to_email,
+            "subject": subject,
+            "body": body,
+            "attachments": attachments,
+            "key": key,
+            "future": future,
+        })
+        return future
+
+    def _ensure_thread(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                threading.Thread(target=self._run, name="mailer", daemon=True).start()
+                self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+
+            deadline = time.monotonic() + MAIL_COALESCE_SECONDS
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            by_recipient = OrderedDict()
+            for message in batch:
+                by_recipient.setdefault(message["to"], []).append(message)
+
+            for to_email, messages in by_recipient.items():
+                try:
+                    self._deliver(to_email, messages)
+                except Exception as e:
+                    for message in messages:
+                        if not message["future"].done():
+                            message["future"].set_exception(e)
+
+    def _deliver(self, to_email, messages):
+        if len(messages) == 1:
+            subject = messages[0]["subject"]
+            body = messages[0]["body"]
+        else:
+            subject = f"{messages[0]['subject']} (+{len(messages) - 1} more)"
+            body = "<hr>".join(m["body"] for m in messages)
+
+        key = hashlib.sha256("|".join(sorted(m["key"] for m in messages)).encode()).hexdigest()
+
+        import sib_api_v3_sdk
+        from sib_api_v3_sdk.rest import ApiException
 
         email = sib_api_v3_sdk.SendSmtpEmail(
-            to=to,
-            sender=sender,
+            to=[{"email": to_email}],
+            sender=MAIL_SENDER,
             subject=subject,
             html_content=f"<html><body><p>{body}</p></body></html>",
-            attachment=attachments
+            attachment=[a for m in messages for a in m["attachments"]],
+            headers={"idempotencyKey": key}
         )
 
-        brevo_api.send_transac_email(email)
-        print("✅ Email sent successfully via Brevo")
+        error = None
+        for attempt in range(MAIL_MAX_RETRIES + 1):
+            if attempt:
+                with self._lock:
+                    self.retries += 1
+                time.sleep(retry_delay(error, attempt))
+
+            self.bucket.acquire()
+            start = time.perf_counter()
+            try:
+                with timed("brevo_send"):
+                    # (connect, read): the SDK ignores a float on its own
+                    get_brevo_api().send_transac_email(
+                        email, _request_timeout=(MAIL_HTTP_TIMEOUT, MAIL_HTTP_TIMEOUT)
+                    )
+                error = None
+                break
+            except ApiException as e:
+                error = e
+                if e.status != 429 and (e.status or 0) < 500:
+                    break
+            except Exception as e:  # connection reset, timeout, ...
+                error = e
+            finally:
+                elapsed = time.perf_counter() - start
+                with self._lock:
+                    self._send_calls += 1
+                    self._send_seconds += elapsed
+                    self._send_max = max(self._send_max, elapsed)
+
+        with self._lock:
+            self.batches += 1
+            self.coalesced += len(messages) - 1
+            if error is None:
+                self.sent += len(messages)
+            else:
+                self.failed += len(messages)
+
+        for message in messages:
+            if error is None:
+                self.sent_keys.set(message["key"], True)
+                message["future"].set_result("sent")
+            else:
+                message["future"].set_exception(error)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queue_depth": self.queue.qsize(),
+                "sent": self.sent,
+                "failed": self.failed,
+                "retries": self.retries,
+                "batches": self.batches,
+                "coalesced": self.coalesced,
+                "duplicates_skipped": self.duplicates,
+                "send_avg_ms": round(self._send_seconds / self._send_calls * 1000, 1)
+                if self._send_calls else 0.0,
+                "send_max_ms": round(self._send_max * 1000, 1),
+            }
+
+
+def retry_delay(error, attempt):
+    retry_after = None
+    headers = getattr(error, "headers", None)
+    if headers:
+        retry_after = headers.get("Retry-After")
+
+    try:
+        return min(float(retry_after), 60.0)
+    except (TypeError, ValueError):
+        return min(2 ** attempt, 30)
+
+
+mailer = Mailer()
+
+
+def send_ticket_email(to_email, subject, body, attachment_path=None, attachment=None,
+                      idempotency_key=None):
+    """Send via Brevo. `attachment` is a (filename, bytes) pair kept in memory.
+
+    Blocks until the mailer thread has delivered it (or given up) so the
+    job queue sees failures.
+    """
+    if not BREVO_API_KEY:
+        print("⚠ Email skipped (Brevo not configured)")
+        return
+
+    from sib_api_v3_sdk.rest import ApiException
+
+    attachments = []
+
+    if attachment_path:
+        with open(attachment_path, "rb") as f:
+            attachment = (os.path.basename(attachment_path), f.read())
+
+    if attachment:
+        name, content = attachment
+        attachments.append({
+            "content": base64.b64encode(content).decode(),
+            "name": name
+        })
+
+    key = idempotency_key or hashlib.sha256(
+        f"{to_email}|{subject}|{body}|{[a['name'] for a in attachments]}".encode()
+    ).hexdigest()
+
+    try:
+        result = mailer.submit(to_email, subject, body, attachments, key).result(
+            timeout=MAIL_SEND_TIMEOUT
+        )
+        if result == "sent":
+            print("✅ Email sent successfully via Brevo")
 
     except ApiException as e:
         print("❌ Brevo Error:", e)
+        raise
+
+
+# =========================================================
+# BACKGROUND JOBS (TICKET PDF + EMAIL)
+# =========================================================
+# Jobs live in the `jobs` table (migrations/001_jobs.sql) and are inserted in
+# the same transaction as the booking, so a booking never exists without its
+# email job.
+#
+# ✅ Set in Koyeb:
+# JOB_WORKER_MODE=thread     run jobs in a thread inside each web worker (default)
+# JOB_WORKER_MODE=external   only enqueue; run `flask --app app run-worker` separately
+JOB_WORKER_MODE = os.getenv("JOB_WORKER_MODE", "thread")
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_BACKOFF_SECONDS = int(os.getenv("JOB_BACKOFF_SECONDS", "15"))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "2"))
+JOB_LOCK_TIMEOUT = int(os.getenv("JOB_LOCK_TIMEOUT", "300"))
+
+JOB_HANDLERS = {
+    "ticket_email": lambda p: generate_ticket_pdf_and_send_email(p["ticket_id"]),
+    "monthly_ticket_email": lambda p: generate_monthly_ticket_pdf_and_send_email(p["monthly_id"]),
+    "bulk_ticket_email": lambda p: generate_bulk_ticket_pdf_and_send_email(p["ticket_ids"]),
+}
+
+
+def enqueue_job(cursor, kind, payload, owner_uid=None):
+    """Insert a job using the caller's cursor (commit is up to the caller)."""
+    cursor.execute("""
+        INSERT INTO jobs (kind, payload, owner_uid, max_attempts, run_at)
+        VALUES (%s, %s, %s, %s, NOW())
+    """, (kind, json.dumps(payload), owner_uid, JOB_MAX_ATTEMPTS))
+    return cursor.lastrowid
+
+
+def claim_job(worker_id):
+    with get_db() as db, db.cursor(dictionary=True) as cursor:
+        db.start_transaction()
+
+        # SKIP LOCKED lets several workers poll the table without blocking
+        # each other. Jobs stuck in 'running' (worker died) are picked up
+        # again after JOB_LOCK_TIMEOUT.
+        cursor.execute("""
+            SELECT id, kind, payload, attempts, max_attempts
+            FROM jobs
+            WHERE (status = 'queued' AND run_at <= NOW())
+               OR (status = 'running' AND locked_at < NOW() - INTERVAL %s SECOND)
+            ORDER BY id
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        """, (JOB_LOCK_TIMEOUT,))
+        job = cursor.fetchone()
+
+        if not job:
+            db.commit()
+            return None
+
+        cursor.execute("""
+            UPDATE jobs
+            SET status = 'running', attempts = attempts + 1,
+                locked_by = %s, locked_at = NOW()
+            WHERE id = %s
+        """, (worker_id, job["id"]))
+        db.commit()
+
+    job["attempts"] += 1
+    if isinstance(job["payload"], (str, bytes, bytearray)):
+        job["payload"] = json.loads(job["payload"])
+    return job
+
+
+def run_job(job):
+    handler = JOB_HANDLERS.get(job["kind"])
+
+    try:
+        if handler is None:
+            raise ValueError(f"Unknown job kind: {job['kind']}")
+        handler(job["payload"])
+    except Exception as e:
+        print(f"❌ Job {job['id']} ({job['kind']}) failed, attempt {job['attempts']}:", e)
+
+        if job["attempts"] >= job["max_attempts"]:
+            status, delay = "dead", 0
+        else:
+            # 15s, 30s, 60s, ... capped at one hour
+            status = "queued"
+            delay = min(JOB_BACKOFF_SECONDS * 2 ** (job["attempts"] - 1), 3600)
+
+        with get_db() as db, db.cursor() as cursor:
+            cursor.execute("""
+                UPDATE jobs
+                SET status = %s, run_at = NOW() + INTERVAL %s SECOND,
+                    locked_by = NULL, locked_at = NULL, last_error = %s
+                WHERE id = %s
+            """, (status, delay, str(e)[:2000], job["id"]))
+        return False
+
+    with get_db() as db, db.cursor() as cursor:
+        cursor.execute("""
+            UPDATE jobs
+            SET status = 'done', locked_by = NULL, locked_at = NULL, last_error = NULL
+            WHERE id = %s
+        """, (job["id"],))
+    return True
+
+
+def run_jobs(stop_event, wake_event=None):
+    worker_id = f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"[:64]
+
+    while not stop_event.is_set():
+        try:
+            job = claim_job(worker_id)
+        except Exception as e:
+            print("Job poll error:", e)
+            job = None
+
+        if job:
+            try:
+                run_job(job)
+            except Exception as e:
+                # Its status UPDATE failed: the row stays 'running' and is
+                # claimed again after JOB_LOCK_TIMEOUT
+                print(f"Job {job['id']} status update error:", e)
+                stop_event.wait(JOB_POLL_SECONDS)
+            continue
+
+        if wake_event is not None:
+            wake_event.wait(JOB_POLL_SECONDS)
+            wake_event.clear()
+        else:
+            stop_event.wait(JOB_POLL_SECONDS)
+
+
+_job_thread = None
+_job_thread_pid = None
+_job_lock = threading.Lock()
+_job_wake = threading.Event()
+_job_stop = threading.Event()
+
+
+def wake_job_worker():
+    """Start the in-process job thread (once per worker) and nudge it."""
+    global _job_thread, _job_thread_pid
+
+    if JOB_WORKER_MODE != "thread":
+        return
+
+    if _job_thread_pid != os.getpid() or not _job_thread.is_alive():
+        with _job_lock:
+            if _job_thread_pid != os.getpid() or not _job_thread.is_alive():
+                _job_thread = threading.Thread(
+                    target=run_jobs, args=(_job_stop, _job_wake),
+                    name="job-worker", daemon=True
+                )
+                _job_thread.start()
+                _job_thread_pid = os.getpid()
+
+    _job_wake.set()
+
+
+@app.before_request
+def start_job_worker():
+    # Picks up jobs left over from a previous deploy without waiting for a booking
+    if JOB_WORKER_MODE == "thread" and _job_thread_pid != os.getpid():
+        wake_job_worker()
+
+
+@app.route("/api/jobs/<int:job_id>", methods=["GET"])
+def job_status(job_id):
+    decoded, error = verify_token()
+    if error:
+        return jsonify({"error": error[0]}), error[1]
+
+    with get_db() as db, db.cursor(dictionary=True) as cursor:
+        cursor.execute("""
+            SELECT id, kind, status, attempts, max_attempts, run_at, created_at, updated_at
+            FROM jobs
+            WHERE id = %s AND owner_uid = %s
+        """, (job_id, decoded["uid"]))
+        job = cursor.fetchone()
+
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+
+    return jsonify(job), 200
+
+
+@app.cli.command("run-worker")
+def run_worker_command():
+    """Run the job worker in the foreground (Procfile `worker:` process)."""
+    print(f"✅ Job worker started (pid {os.getpid()})")
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    try:
+        run_jobs(stop)
+    except KeyboardInterrupt:
+        pass
+
+
+@app.cli.command("requeue-dead-jobs")
+def requeue_dead_jobs_command():
+    """Give dead-lettered jobs a fresh set of attempts."""
+    with get_db() as db, db.cursor() as cursor:
+        cursor.execute("""
+            UPDATE jobs
+            SET status = 'queued', attempts = 0, run_at = NOW(), last_error = NULL
+            WHERE status = 'dead'
+        """)
+        print(f"Requeued {cursor.rowcount} dead job(s)")
+
+
+# =========================================================
+# STARTUP (WARM-UP + IMPORT PROFILE)
+# =========================================================
+def warm_up(certs=None):
+    """Load the PDF/QR/Brevo libraries and prime their caches.
+
+    Called by gunicorn in the master (preload_app, shared copy-on-write) and
+    in each worker before it accepts traffic; also fetches the Firebase
+    signing certs unless TOKEN_PREFETCH_CERTS=0.
+    """
+    start = time.perf_counter()
+
+    import sib_api_v3_sdk  # noqa: F401
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.lib.utils import ImageReader
+    import reportlab.platypus  # noqa: F401
+    import reportlab.pdfgen.canvas  # noqa: F401
+
+    # Font metrics are parsed on first use and cached in pdfmetrics
+    for font in ("Helvetica", "Helvetica-Bold", "Helvetica-Oblique"):
+        pdfmetrics.getFont(font)
+    ticket_templates()
+    # Loads qrcode's PIL image factory and the PNG codec
+    ImageReader(BytesIO(render_qr_png("warm-up"))).getSize()
+
+    if certs is None:
+        certs = os.getenv("TOKEN_PREFETCH_CERTS", "1") == "1"
+    if certs:
+        prefetch_token_certs()
+
+    print(f"🔥 Warm-up done in {(time.perf_counter() - start) * 1000:.0f} ms (pid {os.getpid()})")
+
+
+@app.cli.command("import-report")
+def import_report_command():
+    """Show which packages make `import app` slow (python -X importtime)."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"],
+        cwd=BASE_DIR, capture_output=True, text=True
+    )
 
+    total, totals = 0, {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 0 and name.strip() == "app":
+            total = int(cumulative)
+        elif depth == 1:
+            # Direct imports of app.py; nested ones are already included
+            package = name.strip().split(".")[0]
+            totals[package] = totals.get(package, 0) + int(cumulative)
+
+    print(f"import app: {total / 1000:.0f} ms")
+    for package, us in sorted(totals.items(), key=lambda item: -item[1])[:20]:
+        print(f"  {us / 1000:8.1f} ms  {package}")
+
+    if result.returncode != 0:
+        print(result.stderr.splitlines()[-1] if result.stderr else "import failed")
 
 
 @app.route("/health", methods=["GET"])
 def health():
     return {"status": "ok", "service": "ParkSmart Backend"}, 200
 
+def collect_stats():
+    return {
+        "db_pool": get_pool().stats(),
+        "ticket_cache": ticket_cache.stats(),
+        "qr_cache": qr_cache.stats(),
+        "artifacts": artifact_store().stats(),
+        "token_cache": token_cache.stats(),
+        "user_cache": user_cache.stats(),
+        "slot_index": slot_index.stats(),
+        "idempotency_cache": idempotency_cache.stats(),
+        "mail": mailer.stats(),
+        "firebase_calls": firebase_calls.stats()
+    }
+
+
+def flatten_stats(stats):
+    """[[component, stat, pid, value], ...] for the numeric /api/stats values."""
+    pid = str(os.getpid())
+    return [
+        [component, stat, pid, value]
+        for component, values in stats.items()
+        for stat, value in values.items()
+        if isinstance(value, (int, float)) and stat != "pid"
+    ]
+
+
+@app.route("/api/stats", methods=["GET"])
+def stats():
+    decoded, error = verify_admin()
+    if error:
+        return jsonify({"error": error[0]}), error[1]
+
+    return jsonify(collect_stats()), 200
+
+
+def prometheus_labels(names, values):
+    pairs = [
+        f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+        for name, value in zip(names, values)
+    ]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+METRIC_LABELS = {
+    "parksmart_http_request_duration_seconds": ("method", "route"),
+    "parksmart_http_requests_total": ("method", "route", "status"),
+    "parksmart_phase_duration_seconds": ("phase",),
+    "parksmart_idempotent_replays_total": ("endpoint",),
+}
+
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    metrics.flush(force=True)
+
+    histograms, counters, gauges = {}, {}, []
+    for filename in os.listdir(METRICS_DIR):
+        if not filename.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(METRICS_DIR, filename)) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+
+        for name, labels, values in data.get("histograms", []):
+            key = (name, tuple(labels))
+            total = histograms.setdefault(key, [0] * len(values))
+            histograms[key] = [a + b for a, b in zip(total, values)]
+        for name, labels, value in data.get("counters", []):
+            key = (name, tuple(labels))
+            counters[key] = counters.get(key, 0) + value
+        # Counters from exited workers still count; their gauges don't.
+        if pid_alive(int(filename[:-5])):
+            gauges.extend(data.get("gauges", []))
+
+    lines = []
+    for metric in sorted({name for name, _ in histograms}):
+        lines.append(f"# TYPE {metric} histogram")
+        for (name, labels), values in sorted(histograms.items()):
+            if name != metric:
+                continue
+            names = METRIC_LABELS.get(name, ())
+            for bound, count in zip(LATENCY_BUCKETS, values):
+                le = prometheus_labels(names + ("le",), labels + (bound,))
+                lines.append(f"{name}_bucket{le} {count}")
+            inf = prometheus_labels(names + ("le",), labels + ("+Inf",))
+            lines.append(f"{name}_bucket{inf} {values[-1]}")
+            lines.append(f"{name}_sum{prometheus_labels(names, labels)} {values[-2]}")
+            lines.append(f"{name}_count{prometheus_labels(names, labels)} {values[-1]}")
+
+    for metric in sorted({name for name, _ in counters}):
+        lines.append(f"# TYPE {metric} counter")
+        for (name, labels), value in sorted(counters.items()):
+            if name == metric:
+                lines.append(f"{name}{prometheus_labels(METRIC_LABELS.get(name, ()), labels)} {value}")
+
+    if gauges:
+        lines.append("# TYPE parksmart_stat gauge")
+        for component, stat, pid, value in gauges:
+            labels = prometheus_labels(("component", "stat", "pid"), (component, stat, pid))
+            lines.append(f"parksmart_stat{labels} {value}")
+
+    return app.response_class("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
 @app.route("/api/db-test", methods=["GET"])
 def db_test():
     try:
-        db = get_db()
-        cur = db.cursor()
-        cur.execute("SELECT 1")
-        cur.fetchone()
-        cur.close()
-        db.close()
+        with get_db() as db, db.cursor() as cur:
+            cur.execute("SELECT 1")
+            cur.fetchone()
         return jsonify({"ok": True}), 200
     except Exception as e:
         return jsonify({"ok": False, "error": str(e)}), 500
 # ---------------- RUN SERVER ----------------
 if __name__ == "__main__":
     port = int(os.getenv("PORT", "8000"))
+    warm_up()
     app.run(host="0.0.0.0", port=port)
 
 
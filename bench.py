@@ -0,0 +1,1065 @@
+"""Benchmarks for the ParkSmart backend.
+
+Everything runs in-process against local stand-ins, so no credentials,
+MySQL server or network are needed:
+
+  - MySQL: a SQLite file behind a mysql.connector-compatible connection
+  - firebase_admin.auth: accepts any bearer token, uid = token
+  - sib_api_v3_sdk: Brevo client that records sends instead of emailing,
+    or (bench.py mail) the real client against FakeBrevo, a local HTTP server
+
+Results are printed as JSON so runs can be diffed.
+
+    python bench.py load --routes booked-slots,ticket-pdf --concurrency 8 --requests 1000
+    python bench.py micro --n 200
+    python bench.py tickets --n 200
+    python bench.py layout --n 200
+    python bench.py reprice --n 200
+    python bench.py slow --concurrency 16 --requests 400
+    python bench.py reserve --concurrency 8 --slots 50 --requests 400
+    python bench.py export --concurrency 4 --seed 400
+    python bench.py dump --seed 100000
+    python bench.py mail --n 200
+"""
+import argparse
+import datetime
+import http.server
+import itertools
+import json
+import os
+import random
+import re
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import types
+
+
+# ---------------- STUBS ----------------
+def stub_firebase(delay=0.0):
+    """Stand-in for firebase_admin. Makes `import app` skip the real init."""
+    firebase_admin = types.ModuleType("firebase_admin")
+    firebase_admin._apps = {"[DEFAULT]": "bench"}
+    firebase_admin.credentials = types.ModuleType("firebase_admin.credentials")
+    auth = types.ModuleType("firebase_admin.auth")
+
+    def verify_id_token(token, clock_skew_seconds=0):
+        time.sleep(delay)
+        # "admin" carries the custom claim set_admin.py grants
+        return {"uid": token, "exp": time.time() + 3600, "admin": token == "admin"}
+
+    def get_user(uid):
+        time.sleep(delay)
+        return types.SimpleNamespace(uid=uid, email=f"{uid}@bench.local")
+
+    def fetch_certs(url, method="GET", **kwargs):
+        time.sleep(delay)
+        return types.SimpleNamespace(status=200, data=b'{"bench-key": "bench-cert"}')
+
+    auth.verify_id_token = verify_id_token
+    auth.get_user = get_user
+    # verify_token() reads signing key ids through this to spot key rotation
+    auth._get_client = lambda app=None: types.SimpleNamespace(
+        _token_verifier=types.SimpleNamespace(request=fetch_certs)
+    )
+    firebase_admin.auth = auth
+
+    sys.modules["firebase_admin"] = firebase_admin
+    sys.modules["firebase_admin.credentials"] = firebase_admin.credentials
+    sys.modules["firebase_admin.auth"] = auth
+    return firebase_admin
+
+
+def stub_brevo(delay=0.0):
+    """Stand-in for sib_api_v3_sdk that records sends."""
+    sdk = types.ModuleType("sib_api_v3_sdk")
+    rest = types.ModuleType("sib_api_v3_sdk.rest")
+
+    class ApiException(Exception):
+        def __init__(self, status=None, reason=None):
+            super().__init__(reason)
+            self.status = status
+            self.headers = {}
+
+    class Configuration:
+        def __init__(self):
+            self.api_key = {}
+            self.host = "https://api.brevo.com/v3"
+            self.connection_pool_maxsize = 4
+
+    class ApiClient:
+        def __init__(self, configuration=None):
+            self.configuration = configuration
+
+    class SendSmtpEmail:
+        def __init__(self, **kwargs):
+            self.__dict__.update(kwargs)
+
+    class TransactionalEmailsApi:
+        sent = []
+
+        def __init__(self, api_client=None):
+            self.api_client = api_client
+
+        def send_transac_email(self, email, **kwargs):
+            time.sleep(delay)
+            self.sent.append(email)
+            return {"messageId": f"<bench-{len(self.sent)}>"}
+
+    rest.ApiException = ApiException
+    sdk.rest = rest
+    sdk.Configuration = Configuration
+    sdk.ApiClient = ApiClient
+    sdk.SendSmtpEmail = SendSmtpEmail
+    sdk.TransactionalEmailsApi = TransactionalEmailsApi
+
+    sys.modules["sib_api_v3_sdk"] = sdk
+    sys.modules["sib_api_v3_sdk.rest"] = rest
+    return sdk
+
+
+class FakeBrevo:
+    """Local HTTP server standing in for the Brevo API (POST /v3/smtp/email).
+
+    Used with the real sib_api_v3_sdk client (BREVO_API_HOST=fake.url), so
+    the mailer's HTTP paths run for real: `script` is a list of responses
+    served before the default 201s, e.g. {"status": 429, "headers":
+    {"Retry-After": "0.5"}} or {"status": 201, "delay": 1.0}.
+    """
+
+    def __init__(self):
+        self.script = []
+        self.requests = []  # (client port, idempotencyKey header)
+        self._lock = threading.Lock()
+        fake = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, as api.brevo.com
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                with fake._lock:
+                    fake.requests.append((self.client_address[1], body.get("headers", {}).get("idempotencyKey")))
+                    step = fake.script.pop(0) if fake.script else {}
+
+                time.sleep(step.get("delay", 0))
+                status = step.get("status", 201)
+                payload = json.dumps(
+                    {"messageId": f"<fake-{len(fake.requests)}>"} if status < 300
+                    else {"code": "error", "message": f"fake {status}"}
+                ).encode()
+
+                try:
+                    self.send_response(status)
+                    for name, value in step.get("headers", {}).items():
+                        self.send_header(name, value)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(payload)))
+                    self.end_headers()
+                    self.wfile.write(payload)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # the client timed out first, as intended
+
+            def log_message(self, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/v3"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def connections(self):
+        with self._lock:
+            return len({port for port, _ in self.requests})
+
+    def stop(self):
+        self.server.shutdown()
+
+
+# ---------------- MYSQL STAND-IN (SQLITE) ----------------
+SCHEMA = """
+CREATE TABLE users (
+    firebase_uid TEXT PRIMARY KEY,
+    email TEXT
+);
+CREATE TABLE bookings (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    firebase_uid TEXT, slot_no INTEGER, vehicle_no TEXT, location TEXT,
+    latitude REAL, longitude REAL, booking_date DATE,
+    created_at DATETIME, entry_time DATETIME, exit_time DATETIME,
+    total_hours INTEGER, parking_amount INTEGER, status TEXT
+);
+CREATE INDEX idx_bookings_active_slots ON bookings (location, booking_date, exit_time, slot_no);
+CREATE UNIQUE INDEX uniq_bookings_active_slot ON bookings (location, booking_date, slot_no)
+    WHERE exit_time IS NULL;
+CREATE TABLE monthly_bookings (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    firebase_uid TEXT, customer_name TEXT, email TEXT, phone_no TEXT,
+    vehicle_no TEXT, location TEXT, latitude REAL, longitude REAL,
+    package_months INTEGER, amount INTEGER,
+    start_date DATE, end_date DATE, created_at DATETIME
+);
+CREATE TABLE jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT, payload TEXT, owner_uid TEXT,
+    status TEXT DEFAULT 'queued', attempts INTEGER DEFAULT 0, max_attempts INTEGER,
+    run_at DATETIME, locked_by TEXT, locked_at DATETIME, last_error TEXT,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP, updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE booking_rollups (
+    day DATE, location TEXT, hour INTEGER,
+    bookings INTEGER, hours INTEGER, revenue REAL,
+    PRIMARY KEY (day, location, hour)
+);
+CREATE TABLE monthly_pass_rollups (
+    month DATE, location TEXT, passes INTEGER, months INTEGER, revenue REAL,
+    PRIMARY KEY (month, location)
+);
+CREATE TABLE idempotency_keys (
+    firebase_uid TEXT, endpoint TEXT, idem_key TEXT, request_hash TEXT,
+    status_code INTEGER, response TEXT, created_at DATETIME, expires_at DATETIME,
+    PRIMARY KEY (firebase_uid, endpoint, idem_key)
+);
+CREATE TABLE slot_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    location TEXT, booking_date DATE, slot_no TEXT, occupied INTEGER,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+sqlite3.register_adapter(datetime.datetime, lambda v: v.isoformat(" "))
+sqlite3.register_adapter(datetime.date, lambda v: v.isoformat())
+sqlite3.register_converter("DATETIME", lambda v: datetime.datetime.fromisoformat(v.decode()))
+sqlite3.register_converter("DATE", lambda v: datetime.date.fromisoformat(v.decode()))
+
+_SQL_REWRITES = [
+    (re.compile(r"NOW\(\)\s*([+-])\s*INTERVAL\s+(%s|\d+)\s+(SECOND|MINUTE|HOUR|DAY)", re.I),
+     lambda m: f"datetime('now', 'localtime', '{m.group(1)}' || {m.group(2)} || ' {m.group(3).lower()}s')"),
+    (re.compile(r"NOW\(\)", re.I), lambda m: "datetime('now', 'localtime')"),
+    (re.compile(r"CURDATE\(\)", re.I), lambda m: "date('now', 'localtime')"),
+    (re.compile(r"\s+FOR UPDATE(\s+SKIP LOCKED)?", re.I), lambda m: ""),
+    (re.compile(r"ON DUPLICATE KEY UPDATE", re.I), lambda m: "ON CONFLICT DO UPDATE SET"),
+    (re.compile(r"\bVALUES\((\w+)\)", re.I), lambda m: f"excluded.{m.group(1)}"),
+]
+
+
+def translate_sql(sql):
+    for pattern, replacement in _SQL_REWRITES:
+        sql = pattern.sub(replacement, sql)
+    return sql.replace("%s", "?")
+
+
+class StandInCursor:
+    def __init__(self, connection, dictionary=False, buffered=None):
+        self._connection = connection
+        self._cursor = connection._db.cursor()
+        self._dictionary = dictionary
+        self._first_id = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def lastrowid(self):
+        return self._first_id or self._cursor.lastrowid
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def _execute(self, sql, params):
+        try:
+            self._cursor.execute(translate_sql(sql), tuple(params))
+        except sqlite3.IntegrityError as e:
+            # what mysql.connector raises for a unique key violation
+            import mysql.connector
+            raise mysql.connector.IntegrityError(msg=str(e), errno=1062) from e
+
+    def execute(self, sql, params=()):
+        self._first_id = None
+        self._execute(sql, params or ())
+
+    def executemany(self, sql, seq):
+        # mysql.connector reports the first id of a multi-row INSERT
+        first_id = None
+        for params in seq:
+            self._execute(sql, params)
+            first_id = first_id or self._cursor.lastrowid
+        self._first_id = first_id
+
+    def _row(self, row):
+        if row is None or not self._dictionary:
+            return row
+        return {d[0]: v for d, v in zip(self._cursor.description, row)}
+
+    def fetchone(self):
+        return self._row(self._cursor.fetchone())
+
+    def fetchall(self):
+        return [self._row(r) for r in self._cursor.fetchall()]
+
+    def fetchmany(self, size=1):
+        return [self._row(r) for r in self._cursor.fetchmany(size)]
+
+    def close(self):
+        self._cursor.close()
+
+
+class StandInConnection:
+    """Just enough of mysql.connector's connection API for app.py."""
+
+    def __init__(self, path):
+        self._db = sqlite3.connect(
+            path, detect_types=sqlite3.PARSE_DECLTYPES,
+            isolation_level=None, check_same_thread=False, timeout=30
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self.in_transaction = False
+        self.unread_result = False
+
+    def cursor(self, dictionary=False, buffered=None):
+        return StandInCursor(self, dictionary=dictionary)
+
+    def start_transaction(self, **kwargs):
+        self._db.execute("BEGIN IMMEDIATE")
+        self.in_transaction = True
+
+    def commit(self):
+        if self.in_transaction:
+            self._db.execute("COMMIT")
+            self.in_transaction = False
+
+    def rollback(self):
+        if self.in_transaction:
+            self._db.execute("ROLLBACK")
+            self.in_transaction = False
+
+    def consume_results(self):
+        pass
+
+    def ping(self, **kwargs):
+        pass
+
+    def reconnect(self, **kwargs):
+        pass
+
+    def is_connected(self):
+        return True
+
+    def close(self):
+        self._db.close()
+
+    def shutdown(self):
+        self._db.close()
+
+
+def stub_mysql(path):
+    import mysql.connector
+
+    db = sqlite3.connect(path)
+    db.executescript(SCHEMA)
+    db.close()
+
+    mysql.connector.connect = lambda **kwargs: StandInConnection(path)
+    return path
+
+
+# ---------------- APP LOADING ----------------
+def load_app(db_path=None, firebase_delay=0.0, brevo_delay=0.0, brevo_host=None):
+    """brevo_host: use the real Brevo SDK against this URL (a FakeBrevo)
+    instead of the in-process SDK stand-in."""
+    stub_firebase(firebase_delay)
+    if brevo_host:
+        os.environ["BREVO_API_HOST"] = brevo_host
+    else:
+        stub_brevo(brevo_delay)
+    os.environ["BREVO_API_KEY"] = "bench"
+    os.environ["TOKEN_PREFETCH_CERTS"] = "0"
+    os.environ.setdefault("JOB_WORKER_MODE", "external")
+
+    if db_path:
+        stub_mysql(db_path)
+
+    import app
+    app.export_pool_initializer = export_pool_stubs
+    return app
+
+
+def export_pool_stubs():
+    """Export pool initializer: spawned children import app afresh, so they
+    need the stand-ins too or the Firebase init fails there."""
+    stub_firebase()
+    stub_brevo()
+    os.environ["BREVO_API_KEY"] = "bench"
+    os.environ["TOKEN_PREFETCH_CERTS"] = "0"
+
+
+def seed_bookings(app, n, locations=("Central Mall", "City Station", "Airport")):
+    """Insert n open bookings for today; returns their ids."""
+    today = datetime.date.today().isoformat()
+    ids = []
+    with app.get_db() as db, db.cursor() as cursor:
+        for i in range(n):
+            cursor.execute("""
+                INSERT INTO bookings
+                (firebase_uid, slot_no, vehicle_no, location, latitude, longitude,
+                 booking_date, created_at, entry_time)
+                VALUES (%s,%s,%s,%s,%s,%s,%s,NOW(),NOW() - INTERVAL %s HOUR)
+            """, (f"user-{i % 50}", i, f"KA01-{i:04d}", locations[i % len(locations)],
+                  12.97, 77.59, today, 1 + i % 5))
+            ids.append(cursor.lastrowid)
+    return ids
+
+
+def sample_booking(ticket_id=1):
+    return {
+        "id": ticket_id,
+        "firebase_uid": "bench-user",
+        "slot_no": 12,
+        "vehicle_no": "KA01AB1234",
+        "location": "Central Mall",
+        "latitude": 12.9716,
+        "longitude": 77.5946,
+        "booking_date": datetime.date(2026, 1, 15),
+        "created_at": datetime.datetime(2026, 1, 15, 9, 30),
+        "entry_time": datetime.datetime(2026, 1, 15, 9, 30),
+    }
+
+
+def sample_monthly_booking(monthly_id=1):
+    return {
+        "id": monthly_id,
+        "firebase_uid": "bench-user",
+        "customer_name": "Bench User",
+        "email": "bench@example.com",
+        "phone_no": "9999999999",
+        "vehicle_no": "KA01AB1234",
+        "location": "Central Mall",
+        "latitude": 12.9716,
+        "longitude": 77.5946,
+        "package_months": 3,
+        "amount": 4500,
+        "start_date": datetime.date(2026, 1, 15),
+        "end_date": datetime.date(2026, 4, 15),
+        "created_at": datetime.datetime(2026, 1, 15, 9, 30),
+    }
+
+
+# ---------------- HELPERS ----------------
+def rate(fn, n):
+    start = time.perf_counter()
+    for i in range(n):
+        fn(i)
+    elapsed = time.perf_counter() - start
+    return {"n": n, "seconds": round(elapsed, 4), "per_second": round(n / elapsed, 1)}
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(latencies, elapsed, statuses):
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "req_per_s": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "statuses": statuses,
+    }
+
+
+def run_load(make_request, concurrency, total):
+    """Call make_request(i) `total` times from `concurrency` threads."""
+    counter = itertools.count()
+    latencies, statuses = [], {}
+    lock = threading.Lock()
+
+    def worker():
+        local, local_statuses = [], {}
+        while True:
+            i = next(counter)
+            if i >= total:
+                break
+            start = time.perf_counter()
+            status = make_request(i)
+            local.append(time.perf_counter() - start)
+            local_statuses[status] = local_statuses.get(status, 0) + 1
+
+        with lock:
+            latencies.extend(local)
+            for status, count in local_statuses.items():
+                statuses[str(status)] = statuses.get(str(status), 0) + count
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    return summarize(latencies, time.perf_counter() - start, statuses)
+
+
+# ---------------- ROUTES UNDER LOAD ----------------
+def route_requests(app, booking_ids):
+    """name -> callable(client, i) returning the HTTP status."""
+    today = datetime.date.today().isoformat()
+    revoke_ids = iter(list(booking_ids))
+    revoke_lock = threading.Lock()
+    slots = itertools.count(100000)
+
+    def booked_slots(client, i):
+        location = ("Central Mall", "City Station", "Airport")[i % 3]
+        return client.get(f"/api/booked-slots?date={today}&location={location}").status_code
+
+    def ticket_pdf(client, i):
+        return client.get(f"/api/ticket-pdf/{random.choice(booking_ids)}").status_code
+
+    def confirm_booking(client, i):
+        return client.post("/api/confirm-booking", headers={"Authorization": f"Bearer user-{i % 50}"}, json={
+            "slot": next(slots), "vehicle": f"KA02-{i:05d}", "location": "Central Mall",
+            "latitude": 12.97, "longitude": 77.59, "date": today,
+        }).status_code
+
+    new_users = itertools.count()
+
+    def confirm_booking_new_user(client, i):
+        # Unknown token and uid: verify_id_token and get_user both hit Firebase
+        return client.post("/api/confirm-booking", headers={"Authorization": f"Bearer new-{next(new_users)}"}, json={
+            "slot": next(slots), "vehicle": f"KA03-{i:05d}", "location": "City Station",
+            "latitude": 12.97, "longitude": 77.59, "date": today,
+        }).status_code
+
+    retry_slots = {}
+
+    def confirm_booking_retry(client, i):
+        # Every key is sent 4 times, like a client retrying a lost response
+        key = i // 4
+        slot = retry_slots.setdefault(key, next(slots))
+        return client.post("/api/confirm-booking", headers={
+            "Authorization": f"Bearer user-{key % 50}", "Idempotency-Key": f"retry-{key}",
+        }, json={
+            "slot": slot, "vehicle": f"KA05-{key:05d}", "location": "Airport",
+            "latitude": 12.97, "longitude": 77.59, "date": today,
+        }).status_code
+
+    def revoke_booking(client, i):
+        with revoke_lock:
+            booking_id = next(revoke_ids, None)
+        if booking_id is None:
+            return "exhausted"
+        return client.post("/api/admin/revoke-booking", headers={"Authorization": "Bearer admin"},
+                           json={"booking_id": booking_id}).status_code
+
+    return {
+        "booked-slots": booked_slots,
+        "ticket-pdf": ticket_pdf,
+        "confirm-booking": confirm_booking,
+        "revoke-booking": revoke_booking,
+        "confirm-booking-new-user": confirm_booking_new_user,
+        "confirm-booking-retry": confirm_booking_retry,
+    }
+
+
+# ---------------- BENCHMARKS ----------------
+def bench_load(args):
+    """req/s and latency percentiles per route under --concurrency threads."""
+    with tempfile.TemporaryDirectory() as tmp:
+        app = load_app(
+            os.path.join(tmp, "bench.db"),
+            firebase_delay=args.firebase_delay, brevo_delay=args.brevo_delay,
+        )
+        app.BASE_DIR = tmp
+        app.db_pool_config["size"] = max(args.concurrency, app.db_pool_config["size"])
+
+        booking_ids = seed_bookings(app, args.seed)
+        requests = route_requests(app, booking_ids)
+        clients = threading.local()
+
+        def client():
+            if not hasattr(clients, "client"):
+                clients.client = app.app.test_client()
+            return clients.client
+
+        results = {}
+        for name in args.routes.split(","):
+            make = requests[name]
+            run_load(lambda i: make(client(), i), args.concurrency, args.warmup)
+            results[name] = run_load(lambda i: make(client(), i), args.concurrency, args.requests)
+
+        results["_config"] = {
+            "concurrency": args.concurrency,
+            "seeded_bookings": args.seed,
+            "firebase_delay": args.firebase_delay,
+            "brevo_delay": args.brevo_delay,
+        }
+        return results
+
+
+def bench_micro(args):
+    """Renderers, QR and the revoke pricing path, one call at a time."""
+    app = load_app()
+    entry = datetime.datetime(2026, 1, 15, 9, 30)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app.BASE_DIR = tmp
+        return {
+            "qr_png": rate(lambda i: app.render_qr_png(f"https://www.google.com/maps?q={i},77.59"), args.n),
+            # A handful of locations, as in production
+            "qr_cached": rate(lambda i: app.get_qr_png(f"https://www.google.com/maps?q={i % 5},77.59"), args.n),
+            "hourly_pdf": rate(lambda i: app.render_ticket_pdf(sample_booking(i)), args.n),
+            "monthly_pdf": rate(lambda i: app.render_monthly_ticket_pdf(sample_monthly_booking(i)), args.n),
+            "revoke_pricing": rate(
+                lambda i: app.compute_parking_charge(entry, entry + datetime.timedelta(minutes=i)),
+                args.n * 1000,
+            ),
+        }
+
+
+def bench_tickets(args):
+    """Tickets/sec through each artifact store backend: first render (miss,
+    render + store) and re-read by a fresh process (store hit, no render)."""
+    app = load_app()
+    results = {}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app.BASE_DIR = tmp
+
+        for backend in ("none", "memory", "fs"):
+            app.ARTIFACT_STORE = backend
+            app._artifact_store["pid"] = None
+            results[backend] = {}
+
+            for phase in ("miss", "hit"):
+                app.ticket_cache.clear()  # as in a restarted worker
+                results[backend][phase] = {
+                    "hourly": rate(lambda i: app.get_ticket_pdf_bytes(sample_booking(i)), args.n),
+                    "monthly": rate(
+                        lambda i: app.get_monthly_ticket_pdf_bytes(sample_monthly_booking(i)), args.n
+                    ),
+                }
+            results[backend]["store"] = app.artifact_store().stats()
+
+    return results
+
+
+def bench_layout(args):
+    """Layout cost alone: the QR is rendered once up front, so this is the
+    per-ticket stamping cost of the cached templates (one core)."""
+    app = load_app()
+    qr_png = app.render_qr_png("https://www.google.com/maps?q=12.9716,77.5946")
+    app.render_qr_png = lambda payload: qr_png
+
+    start = time.perf_counter()
+    app.ticket_templates()
+    build_ms = (time.perf_counter() - start) * 1000
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app.BASE_DIR = tmp
+        return {
+            "template_build_ms": round(build_ms, 2),
+            "hourly": rate(lambda i: app.render_ticket_pdf(sample_booking(i)), args.n),
+            "monthly": rate(lambda i: app.render_monthly_ticket_pdf(sample_monthly_booking(i)), args.n),
+            "bulk_10": rate(
+                lambda i: app.render_tickets_pdf([sample_booking(i * 10 + j) for j in range(10)]),
+                max(1, args.n // 10),
+            ),
+        }
+
+
+def bench_reprice(args):
+    """Vectorized tariff re-pricing of --n * 5000 synthetic bookings."""
+    import numpy as np
+
+    app = load_app()
+    tariffs = app.load_tariffs(json.dumps({
+        "default": {"rate": 50},
+        "Airport": {"rate": 80, "bands": [{"from": 22, "to": 6, "rate": 40}],
+                    "daily_cap": 800, "grace_minutes": 10},
+    }))
+
+    n = args.n * 5000
+    rng = np.random.default_rng(0)
+    entries = np.datetime64("2026-01-01T00:00:00", "us") + rng.integers(
+        0, 90 * 86400 * 10**6, n).astype("timedelta64[us]")
+    exits = entries + rng.integers(0, 3 * 86400 * 10**6, n).astype("timedelta64[us]")
+    locations = rng.choice(np.array(["Central Mall", "City Station", "Airport"]), n)
+
+    start = time.perf_counter()
+    app.reprice(entries, exits, locations, tariffs)
+    seconds = time.perf_counter() - start
+
+    return {"bookings": n, "seconds": round(seconds, 4), "per_second": round(n / seconds, 1)}
+
+
+def bench_slow(args):
+    """req/s with slow Firebase / Brevo stand-ins (--firebase-delay and
+    --brevo-delay, default 0.5 s and 1 s): routes that don't need them,
+    routes that do, both at once, and with OUTBOUND_TIMEOUT below the delay.
+    """
+    firebase_delay = args.firebase_delay or 0.5
+    brevo_delay = args.brevo_delay or 1.0
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["JOB_WORKER_MODE"] = "thread"  # ticket emails go out during the run
+        app = load_app(os.path.join(tmp, "bench.db"), firebase_delay, brevo_delay)
+        app.BASE_DIR = tmp
+        app.db_pool_config["size"] = max(args.concurrency, app.db_pool_config["size"])
+
+        requests = route_requests(app, seed_bookings(app, args.seed))
+        clients = threading.local()
+
+        def load(name, concurrency, total):
+            def make(i):
+                if not hasattr(clients, "client"):
+                    clients.client = app.app.test_client()
+                return requests[name](clients.client, i)
+            return run_load(make, concurrency, total)
+
+        # Known users: tokens and emails cached after the warm-up
+        load("confirm-booking", args.concurrency, 50)
+
+        results = {
+            "booked-slots": load("booked-slots", args.concurrency, args.requests),
+            "confirm-booking": load("confirm-booking", args.concurrency, args.requests),
+            "confirm-booking-new-user": load(
+                "confirm-booking-new-user", args.concurrency, args.requests // 5
+            ),
+        }
+
+        mixed = {}
+        half = max(1, args.concurrency // 2)
+        threads = [
+            threading.Thread(target=lambda: mixed.update(
+                {"confirm-booking-new-user": load("confirm-booking-new-user", half, args.requests // 10)}
+            )),
+            threading.Thread(target=lambda: mixed.update(
+                {"booked-slots": load("booked-slots", half, args.requests)}
+            )),
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        results["mixed"] = mixed
+
+        app.OUTBOUND_TIMEOUT = firebase_delay / 2
+        results["confirm-booking-new-user (timeout < delay)"] = load(
+            "confirm-booking-new-user", args.concurrency, args.requests // 10
+        )
+
+        results["_stats"] = {"firebase_calls": app.firebase_calls.stats(), "mail": app.mailer.stats()}
+        results["_config"] = {
+            "concurrency": args.concurrency,
+            "firebase_delay": firebase_delay,
+            "brevo_delay": brevo_delay,
+            "outbound_max_concurrency": app.OUTBOUND_MAX_CONCURRENCY,
+        }
+        return results
+
+
+def bench_reserve(args):
+    """Concurrent check-ins racing for the same slots.
+
+    "race": --concurrency clients book one location/date until all
+    --slots are taken, retrying with the first of the 409's free_slots.
+    Checks that no slot ends up with two active bookings.
+    "throughput": req/s at 1..--concurrency threads, on distinct slots
+    and on 8 contended slots. The SQLite stand-in has a single writer, so
+    this shows the conflict path costs no more than a booking, not how
+    MySQL scales.
+    """
+    today = datetime.date.today().isoformat()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = load_app(os.path.join(tmp, "bench.db"))
+        app.BASE_DIR = tmp
+        app.db_pool_config["size"] = max(args.concurrency, app.db_pool_config["size"])
+        app.SLOTS_PER_LOCATION = args.slots
+        clients = threading.local()
+
+        def book(i, location, slot):
+            if not hasattr(clients, "client"):
+                clients.client = app.app.test_client()
+            response = clients.client.post(
+                "/api/confirm-booking", headers={"Authorization": f"Bearer user-{i % 50}"}, json={
+                    "slot": slot, "vehicle": f"KA04-{i:05d}", "location": location,
+                    "latitude": 12.97, "longitude": 77.59, "date": today,
+                })
+            return response.status_code, response.get_json()
+
+        def race(location):
+            attempts = itertools.count()
+            counts = {"201": 0, "409": 0}
+            lock = threading.Lock()
+
+            def client():
+                slot = random.randint(1, args.slots)
+                while slot is not None:
+                    status, body = book(next(attempts), location, slot)
+                    with lock:
+                        counts[str(status)] = counts.get(str(status), 0) + 1
+                    if status != 409:
+                        slot = random.randint(1, args.slots)
+                        if len(app.load_occupied_slots(location, today)) >= args.slots:
+                            break
+                    else:
+                        slot = (body["free_slots"] or [None])[0]
+
+            threads = [threading.Thread(target=client) for _ in range(args.concurrency)]
+            start = time.perf_counter()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            elapsed = time.perf_counter() - start
+
+            with app.get_db() as db, db.cursor() as cursor:
+                cursor.execute("""
+                    SELECT slot_no, COUNT(*) FROM bookings
+                    WHERE location=%s AND booking_date=%s AND exit_time IS NULL
+                    GROUP BY slot_no
+                """, (location, today))
+                rows = cursor.fetchall()
+
+            return {
+                "slots": args.slots,
+                "statuses": counts,
+                "booked_slots": len(rows),
+                "double_booked": sum(1 for _, n in rows if n > 1),
+                "seconds": round(elapsed, 3),
+            }
+
+        def throughput(concurrency, contended):
+            slots = itertools.count(1)
+            location = f"{'Contended' if contended else 'Open'} {concurrency}"
+
+            def make(i):
+                slot = 1 + i % 8 if contended else next(slots)
+                return book(i, location, slot)[0]
+
+            return run_load(make, concurrency, args.requests)
+
+        results = {"race": race("Race Lot")}
+        results["throughput"] = {}
+        concurrency = 1
+        while concurrency <= args.concurrency:
+            results["throughput"][concurrency] = {
+                "distinct": throughput(concurrency, contended=False),
+                "contended": throughput(concurrency, contended=True),
+            }
+            concurrency *= 2
+        return results
+
+
+def bench_export(args):
+    """/api/admin/export-tickets: --seed hourly tickets and --seed / 2 active
+    monthly passes as a ZIP, with 1 pool process and with --concurrency.
+    The pool processes are spawned before timing."""
+    import io
+    import zipfile
+
+    today = datetime.date.today()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = load_app(os.path.join(tmp, "bench.db"))
+        app.BASE_DIR = tmp
+        seed_bookings(app, args.seed)
+
+        with app.get_db() as db, db.cursor() as cursor:
+            for i in range(args.seed // 2):
+                row = sample_monthly_booking()
+                del row["id"]
+                row.update(start_date=today, end_date=today + datetime.timedelta(days=90),
+                           vehicle_no=f"KA01-M{i:04d}")
+                cursor.execute(
+                    f"INSERT INTO monthly_bookings ({', '.join(row)}) VALUES ({', '.join(['%s'] * len(row))})",
+                    tuple(row.values()),
+                )
+
+        client = app.app.test_client()
+        results = {}
+
+        for workers in sorted({1, args.concurrency}):
+            app.EXPORT_WORKERS = workers
+            app._export_pool["pid"] = None
+            pool = app.get_export_pool()
+            list(pool.map(abs, range(workers)))  # spawn them now
+
+            results[workers] = {}
+            for kind, query in (("hourly", f"date={today.isoformat()}"), ("monthly", "")):
+                app.ticket_cache.clear()
+                start = time.perf_counter()
+                response = client.get(f"/api/admin/export-tickets?kind={kind}&{query}",
+                                      headers={"Authorization": "Bearer admin"})
+                body = response.get_data()
+                response.close()  # as the WSGI server would; ends the export
+                elapsed = time.perf_counter() - start
+
+                archive = zipfile.ZipFile(io.BytesIO(body))
+                assert archive.testzip() is None
+                tickets = len(archive.namelist())
+                results[workers][kind] = {
+                    "status": response.status_code,
+                    "tickets": tickets,
+                    "zip_bytes": len(body),
+                    "seconds": round(elapsed, 3),
+                    "tickets_per_second": round(tickets / elapsed, 1),
+                }
+
+            pool.shutdown()
+
+        results["_config"] = {"cpus": os.cpu_count()}
+        return results
+
+
+def bench_dump(args):
+    """Rows/sec for a full-table dump of --seed bookings: the JSON listing
+    vs. /api/admin/export as CSV and NDJSON, and an incremental export of
+    the last 1%."""
+    with tempfile.TemporaryDirectory() as tmp:
+        app = load_app(os.path.join(tmp, "bench.db"))
+        seed_bookings(app, args.seed)
+        client = app.app.test_client()
+        watermark = args.seed - args.seed // 100
+
+        cases = {
+            "admin-bookings-json": ("/api/admin/bookings", args.seed),
+            "export-csv": ("/api/admin/export?table=bookings&format=csv", args.seed),
+            "export-ndjson": ("/api/admin/export?table=bookings&format=ndjson", args.seed),
+            "export-ndjson-since": (
+                f"/api/admin/export?table=bookings&format=ndjson&since={watermark}", args.seed - watermark
+            ),
+        }
+
+        results = {}
+        for name, (url, rows) in cases.items():
+            start = time.perf_counter()
+            response = client.get(url, headers={"Authorization": "Bearer admin"})
+            size = len(response.get_data())
+            elapsed = time.perf_counter() - start
+            results[name] = {
+                "rows": rows,
+                "bytes": size,
+                "seconds": round(elapsed, 3),
+                "rows_per_second": round(rows / elapsed, 1),
+            }
+        return results
+
+
+def bench_mail(args):
+    """The mailer against FakeBrevo over real HTTP: 429 + Retry-After, 5xx
+    retry, 4xx give-up, a response slower than MAIL_HTTP_TIMEOUT, then
+    --n sends to distinct recipients (rate limit lifted) to count the
+    HTTP connections the client reuses."""
+    fake = FakeBrevo()
+    app = load_app(brevo_host=fake.url)
+    app.MAIL_HTTP_TIMEOUT = 0.5
+    attachment = [{"name": "ticket.pdf", "content": "JVBERi0="}]
+
+    def send(to_email, key):
+        start = time.perf_counter()
+        try:
+            outcome = app.mailer.submit(to_email, "Bench", "body", attachment, key).result(timeout=60)
+        except Exception as e:
+            outcome = f"{type(e).__name__}: {getattr(e, 'status', '')}".strip()
+        return outcome, time.perf_counter() - start
+
+    scenarios = {
+        "429-retry-after": [{"status": 429, "headers": {"Retry-After": "0.5"}}],
+        "503-then-ok": [{"status": 503}],
+        "400-no-retry": [{"status": 400}],
+        "slow-response-timeout": [{"status": 201, "delay": 1.5}],
+    }
+
+    results = {}
+    try:
+        for i, (name, script) in enumerate(scenarios.items()):
+            fake.script = list(script)
+            before = len(fake.requests)
+            retries = app.mailer.stats()["retries"]
+            outcome, elapsed = send(f"scenario{i}@example.com", f"scenario-{i}")
+            keys = {key for _, key in fake.requests[before:]}
+            results[name] = {
+                "outcome": outcome,
+                "seconds": round(elapsed, 3),
+                "http_requests": len(fake.requests) - before,
+                "retries": app.mailer.stats()["retries"] - retries,
+                "same_idempotency_key": len(keys) == 1,
+            }
+
+        fake.script = []
+        app.mailer.bucket = app.TokenBucket(10000, 10000)
+        before_connections = fake.connections()
+        start = time.perf_counter()
+        futures = [app.mailer.submit(f"user{i}@example.com", "Bench", "body", attachment, f"bulk-{i}")
+                   for i in range(args.n)]
+        sent = sum(1 for f in futures if f.result(timeout=60) == "sent")
+        elapsed = time.perf_counter() - start
+        results["throughput"] = {
+            "sent": sent,
+            "per_second": round(sent / elapsed, 1),
+            "new_connections": fake.connections() - before_connections,
+        }
+        results["_stats"] = app.mailer.stats()
+    finally:
+        fake.stop()
+
+    return results
+
+
+BENCHMARKS = {
+    "mail": bench_mail,
+    "dump": bench_dump,
+    "export": bench_export,
+    "reserve": bench_reserve,
+    "layout": bench_layout,
+    "reprice": bench_reprice,
+    "slow": bench_slow,
+    "load": bench_load,
+    "micro": bench_micro,
+    "tickets": bench_tickets,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--n", type=int, default=200, help="iterations per micro-benchmark")
+    parser.add_argument("--routes", default="booked-slots,ticket-pdf,confirm-booking,revoke-booking")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=500, help="requests per route")
+    parser.add_argument("--warmup", type=int, default=50, help="unmeasured requests per route")
+    parser.add_argument("--slots", type=int, default=50, help="slots per location for reserve")
+    parser.add_argument("--seed", type=int, default=2000, help="bookings inserted before the load run")
+    parser.add_argument("--firebase-delay", type=float, default=0.0, help="seconds per fake Firebase call")
+    parser.add_argument("--brevo-delay", type=float, default=0.0, help="seconds per fake Brevo send")
+    parser.add_argument("--out", help="also write the JSON result to this file")
+    args = parser.parse_args()
+
+    result = {
+        "benchmark": args.benchmark,
+        "python": sys.version.split()[0],
+        "results": BENCHMARKS[args.benchmark](args),
+    }
+
+    text = json.dumps(result, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+# Gunicorn settings, picked up automatically by `gunicorn app:app` (Procfile).
+# Worker count still comes from WEB_CONCURRENCY, bind from PORT.
+import os
+
+# Threaded workers: an open /api/booked-slots/stream connection holds one
+# thread instead of a whole worker process, and a request waiting on
+# Firebase doesn't stall the others. Of the GUNICORN_THREADS threads per
+# worker, SSE_REQUEST_THREADS (default 16) are kept for ordinary requests
+# and the rest serve live-slot streams (SSE_MAX_STREAMS, default 48; more
+# get a 503 and poll). Raise GUNICORN_THREADS for more streams per worker. Everything shared between threads is
+# thread-safe: the MySQL pool, the LRU caches, the firebase_admin client,
+# and the Brevo client (only used from the mailer thread).
+#
+# Outbound Firebase calls are capped per worker at OUTBOUND_MAX_CONCURRENCY
+# (default 8) with an OUTBOUND_TIMEOUT (default 5 s) deadline, so at most
+# that many threads wait on Google; keep it below GUNICORN_THREADS. See
+# `python bench.py slow` for req/s with slow Firebase/Brevo stand-ins.
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "64"))
+
+# Import app.py (and, via warm_up(), reportlab/qrcode/Brevo) once in the
+# master; forked workers share those pages copy-on-write and boot in
+# milliseconds. Set GUNICORN_PRELOAD=0 to import in every worker instead.
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+
+
+def on_starting(server):
+    # Per-worker metric snapshots from a previous run would be summed into
+    # /metrics; start from zero.
+    import shutil
+    import tempfile
+    metrics_dir = os.getenv("METRICS_DIR", os.path.join(tempfile.gettempdir(), "parksmart-metrics"))
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+
+
+def when_ready(server):
+    # Master, after preload: load the heavy libraries before forking.
+    # Certs are fetched per worker (sockets don't survive fork).
+    if preload_app:
+        from app import warm_up
+        warm_up(certs=False)
+
+
+def post_worker_init(worker):
+    # Runs in the worker before it accepts connections.
+    from app import warm_up
+    warm_up()
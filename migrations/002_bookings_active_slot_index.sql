@@ -0,0 +1,4 @@
+-- Covering index for /api/booked-slots (cold path of the slot index):
+-- WHERE booking_date = ? AND location = ? AND exit_time IS NULL -> slot_no
+ALTER TABLE bookings
+    ADD INDEX idx_bookings_active_slots (location, booking_date, exit_time, slot_no);
@@ -0,0 +1,10 @@
+-- Slot occupancy change feed for /api/booked-slots/stream (one row per change)
+CREATE TABLE IF NOT EXISTS slot_events (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    location VARCHAR(255) NOT NULL,
+    booking_date DATE NOT NULL,
+    slot_no VARCHAR(32) NOT NULL,
+    occupied TINYINT(1) NOT NULL,
+    created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    KEY idx_slot_events_created_at (created_at)
+);
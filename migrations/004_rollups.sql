@@ -0,0 +1,24 @@
+-- Revenue / occupancy rollups for /api/admin/reports, kept up to date in the
+-- same transaction as the checkout / monthly pass sale that changes them.
+-- Backfill (or repair) with: flask --app app rebuild-rollups
+
+-- Checked-out hourly bookings, bucketed by exit_time
+CREATE TABLE IF NOT EXISTS booking_rollups (
+    day DATE NOT NULL,
+    location VARCHAR(255) NOT NULL,
+    hour TINYINT UNSIGNED NOT NULL,
+    bookings INT UNSIGNED NOT NULL DEFAULT 0,
+    hours INT UNSIGNED NOT NULL DEFAULT 0,
+    revenue DECIMAL(12, 2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, location, hour)
+);
+
+-- Monthly pass sales, bucketed by the month the pass starts
+CREATE TABLE IF NOT EXISTS monthly_pass_rollups (
+    month DATE NOT NULL,
+    location VARCHAR(255) NOT NULL,
+    passes INT UNSIGNED NOT NULL DEFAULT 0,
+    months INT UNSIGNED NOT NULL DEFAULT 0,
+    revenue DECIMAL(12, 2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (month, location)
+);
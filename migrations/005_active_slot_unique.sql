@@ -0,0 +1,17 @@
+-- At most one active (not checked out) booking per slot: the unique key
+-- decides races between concurrent confirm-booking requests, the loser
+-- gets ER_DUP_ENTRY (1062) and the API answers 409.
+--
+-- `active` is 1 while exit_time IS NULL and NULL afterwards; NULLs never
+-- collide in a unique key, so finished bookings don't block the slot.
+-- INVISIBLE keeps it out of SELECT * (the admin exports and the bookings
+-- stream), which needs MySQL 8.0.23+.
+--
+-- Clear existing duplicates first, this lists them:
+--   SELECT location, booking_date, slot_no, COUNT(*) FROM bookings
+--   WHERE exit_time IS NULL
+--   GROUP BY location, booking_date, slot_no HAVING COUNT(*) > 1;
+ALTER TABLE bookings
+    ADD COLUMN active TINYINT
+        GENERATED ALWAYS AS (IF(exit_time IS NULL, 1, NULL)) VIRTUAL INVISIBLE,
+    ADD UNIQUE KEY uniq_bookings_active_slot (location, booking_date, slot_no, active);
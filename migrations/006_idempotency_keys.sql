@@ -0,0 +1,15 @@
+-- Idempotency-Key support for the booking POST endpoints: one row per
+-- (user, endpoint, key). status_code / response stay NULL while the first
+-- request is running and hold its response afterwards.
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    firebase_uid VARCHAR(128) NOT NULL,
+    endpoint VARCHAR(64) NOT NULL,
+    idem_key VARCHAR(255) NOT NULL,
+    request_hash CHAR(64) NOT NULL,
+    status_code SMALLINT NULL,
+    response MEDIUMTEXT NULL,
+    created_at DATETIME NOT NULL,
+    expires_at DATETIME NOT NULL,
+    PRIMARY KEY (firebase_uid, endpoint, idem_key),
+    KEY idx_idempotency_keys_expires_at (expires_at)
+);